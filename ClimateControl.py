@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import heapq
 import logging
 import signal
 import time
@@ -12,6 +13,10 @@ from lib.grove import SensirionMonitor, GroveRelay, GroveLCD
 
 log = logging.getLogger("ClimateControl")
 
+# Fewest seconds between two runs of a controller on its own deadline, so a
+# deadline that is due again straight away is retried rather than spun on
+CONTROL_RETRY = 0.1
+
 class SignalMonitor:
     exit = False
     def __init__(self):
@@ -44,9 +49,6 @@ class ClimateControlMain():
     def run(self):
         sm = SignalMonitor()
 
-        # Set the starting hour
-        previous_hour = -1
-        
         for var in self.config.general['env_variables']:
             try:
                 controller = getattr(lib.controllers, var)(self.scd4x, self.relay)
@@ -61,23 +63,33 @@ class ClimateControlMain():
 
         self.scd4x.read_wait_scd4x()
 
+        # Controllers run either on their own deadlines, kept in a heap of
+        # (epoch time, var), or on every new sample when subscribed to them
+        deadlines = []
         for var, controller in self.env_vars.items():
             controller._initialize()
             controller.update_sensor_output()
-        
+            self._schedule(deadlines, var)
+
         while not sm.exit:
+            if deadlines and deadlines[0][0] - time.time() < self.scd4x.sampler.wait_time():
+                time.sleep(max(deadlines[0][0] - time.time(), 0))
+                with self.relay.batch():
+                    self._control_due(deadlines)
+                continue
+
             self.scd4x.read_wait_scd4x()
-                
-            deviations = 0
+
+            # Relay changes made by every controller this sample go out in one write
             current_time = time.localtime(time.time())
-            current_hour = current_time.tm_hour
-                
-            for var, controller in self.env_vars.items():
-                try:
-                    controller.control(current_time)
-                        
-                except:
-                    log.exception('Failed to process environment variable: {}'.format(var))
+            with self.relay.batch():
+                for var, controller in self.env_vars.items():
+                    if controller.wants_sample():
+                        self._control(var, current_time)
+                    else:
+                        controller.update_sensor_output()
+
+                self._control_due(deadlines)
 
             self.lcd.process_lcd(
                 '{}ppm {}F {}%RH'.format(self.scd4x.co2, self.scd4x.tempF, self.scd4x.humidity),
@@ -89,10 +101,40 @@ class ClimateControlMain():
                     )
                 )
 
+    def _control(self, var, current_time):
+        try:
+            self.env_vars[var].control(current_time)
+
+        except:
+            log.exception('Failed to process environment variable: {}'.format(var))
+
+    def _schedule(self, deadlines, var):
+        now = time.time()
+        try:
+            deadline = self.env_vars[var].next_deadline(now)
+
+        except:
+            log.exception('Failed to schedule environment variable: {}'.format(var))
+            deadline = now + CONTROL_RETRY
+
+        if deadline is not None:
+            heapq.heappush(deadlines, (max(deadline, now + CONTROL_RETRY), var))
+
+    def _control_due(self, deadlines):
+        now = time.time()
+        current_time = time.localtime(now)
+        while deadlines and deadlines[0][0] <= now:
+            var = heapq.heappop(deadlines)[1]
+            self._control(var, current_time)
+            self._schedule(deadlines, var)
+
     def close(self):
         self.lcd.process_lcd('De-initializing ClimateControl...', 255, 0, 0)
         log.info('De-initializing ClimateControl... Please be patient')
 
+        # Switches off channels still on a timer, which marks their controllers off
+        self.relay.close()
+
         for var, controller in self.env_vars.items():
             log.info('Shutting down {} relay'.format(var))
             controller.close()
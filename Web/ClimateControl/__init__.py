@@ -6,3 +6,4 @@ from flask import Flask
 app = Flask(__name__)
 
 import ClimateControl.views
+import ClimateControl.api
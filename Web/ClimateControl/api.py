@@ -0,0 +1,116 @@
+"""
+JSON API for the flask application.
+"""
+import re
+import time
+
+from flask import abort, jsonify, redirect, request, Response
+
+from lib.analytics import profile_band, range_stats, DEFAULT_PERCENTILES
+from lib.db import READING_COLUMNS, READING_VARIABLES, to_epoch_ms
+from lib.export import export, parse_bound, EXPORT_FORMATS
+from lib.query import select_since
+
+from ClimateControl import app
+from ClimateControl.resources import get_config, get_db, stream_db, stream_port
+
+# Maximum readings returned by a single /api/readings call
+READINGS_LIMIT = 5000
+
+@app.route('/api/readings')
+def api_readings():
+    """Returns readings newer than the since cursor (epoch milliseconds) as
+    columns.  The returned cursor is passed back as since on the next call,
+    more is set when the limit cut the response short."""
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', READINGS_LIMIT, type=int), READINGS_LIMIT))
+
+    rows = select_since(get_db().cur, since, limit).fetchall()
+
+    data = {column: list(values) for column, values in zip(READING_COLUMNS, zip(*rows))}
+    if not rows:
+        data = {column: [] for column in READING_COLUMNS}
+
+    data['cursor'] = rows[-1][0] if rows else since
+    data['more'] = len(rows) == limit
+
+    response = jsonify(data)
+    response.headers['Cache-Control'] = 'no-store'
+
+    return response
+
+@app.route('/api/export')
+def api_export():
+    """Streams readings between start and end (epoch seconds or ISO 8601 UTC,
+    end exclusive and open ended when omitted) as format csv or npz.  Bad
+    bounds or formats are answered with 400."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+
+    # Bounds are checked before streaming, errors after the headers would
+    # only truncate the download
+    try:
+        start = parse_bound(request.args.get('start', 0))
+        end = parse_bound(request.args.get('end', None))
+    except ValueError:
+        abort(400)
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+
+    return Response(
+        stream_db(export, fmt, start, end),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition'   : 'attachment; filename=readings.{}'.format(extension),
+            'Cache-Control'         : 'no-store'
+            }
+        )
+
+@app.route('/api/stats')
+def api_stats():
+    """Returns min, max, mean, percentiles and the fraction of time spent
+    below, inside and above the active profile's thresholds per variable
+    between start and end (epoch seconds or ISO 8601 UTC, default the last
+    24 hours up to end).  hours=22-6 restricts the range to those local hours, from a
+    start hour 0-23 up to an end hour 0-24.  Bad parameters are answered with
+    400."""
+    try:
+        end = parse_bound(request.args.get('end', None))
+        start = parse_bound(request.args.get('start', None))
+        variables = request.args.get('variables', None)
+        variables = variables.split(',') if variables else list(READING_VARIABLES)
+        percentiles = request.args.get('percentiles', None)
+        percentiles = [float(p) for p in percentiles.split(',')] if percentiles else DEFAULT_PERCENTILES
+        hours = request.args.get('hours', None)
+        hours = [int(h) for h in hours.split('-')] if hours else None
+    except ValueError:
+        abort(400)
+
+    if start is None:
+        start = (to_epoch_ms(end) / 1000 if end is not None else time.time()) - 24 * 3600
+
+    if any(var not in READING_VARIABLES for var in variables) \
+            or any(not 0 <= p <= 100 for p in percentiles) \
+            or (hours and (len(hours) != 2 or not 0 <= hours[0] <= 23 or not 0 <= hours[1] <= 24)):
+        abort(400)
+
+    config = get_config()
+    bands = {var: profile_band(config, var) for var in variables}
+
+    return jsonify(range_stats(get_db().cur, start, end, variables, percentiles, bands, hours))
+
+@app.route('/api/stream')
+def api_stream():
+    """Redirects to the Server-Sent Events stream of each new sensor reading
+    and relay transition ('reading' and 'relay').  Web/streamserver.py serves
+    it, so idle streams do not hold web server threads."""
+    config = get_config()
+    if not config.stream['enabled']:
+        abort(404)
+
+    url = config.stream['url']
+    if not url:
+        url = '{}://{}:{}/api/stream'.format(request.scheme, re.sub(r':\d+$', '', request.host), stream_port(config))
+
+    return redirect(url, 307)
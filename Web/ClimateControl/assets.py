@@ -0,0 +1,52 @@
+"""
+BokehJS served as cacheable static assets.
+"""
+import hashlib
+import os
+
+from bokeh.resources import Resources
+
+class BokehAssets(object):
+    """Serves the BokehJS bundles of the installed bokeh package under content
+    hashed file names, so browsers can cache them forever and each page only
+    carries script tags instead of the inlined library."""
+    def __init__(self, url_prefix='/bokeh/'):
+        self.url_prefix = url_prefix
+        self.files = dict()
+        self.js_names = list()
+        self.css_names = list()
+
+        resources = Resources(mode='absolute')
+        for path in resources.js_files:
+            self.js_names.append(self._register(path))
+        for path in resources.css_files:
+            self.css_names.append(self._register(path))
+
+    def _register(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+        etag = digest.hexdigest()[:16]
+
+        stem, ext = os.path.splitext(os.path.basename(path))
+        name = '{}.{}{}'.format(stem, etag, ext)
+        self.files[name] = (path, etag)
+
+        return name
+
+    def get(self, name):
+        """Returns the (path, etag) of a hashed file name or None"""
+        return self.files.get(name)
+
+    def render_js(self):
+        return '\n'.join(
+            '<script type="text/javascript" src="{}{}"></script>'.format(self.url_prefix, name)
+            for name in self.js_names
+            )
+
+    def render_css(self):
+        return '\n'.join(
+            '<link rel="stylesheet" href="{}{}" type="text/css" />'.format(self.url_prefix, name)
+            for name in self.css_names
+            )
@@ -0,0 +1,66 @@
+"""
+Cache of rendered dashboard pages.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+class RenderCache(object):
+    """LRU cache of rendered pages.  Each entry remembers the version it was
+    rendered from, the newest reading timestamp and the config file mtimes,
+    and is only served while that version is current.  Concurrent misses for the same key wait for a
+    single render instead of each rendering the page."""
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._render_locks = dict()
+
+    def _lookup(self, key, version):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        return None
+
+    def get_or_render(self, key, version, render):
+        page = self._lookup(key, version)
+        if page is not None:
+            return page
+
+        with self._lock:
+            render_lock = self._render_locks.setdefault(key, Lock())
+
+        with render_lock:
+            try:
+                # Another request may have rendered it while we waited
+                page = self._lookup(key, version)
+                if page is not None:
+                    return page
+
+                page = render()
+
+                with self._lock:
+                    self.misses += 1
+                    self.entries[key] = (version, page)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+
+            finally:
+                # Requests already waiting hold the lock, later ones find the
+                # page cached or start a render of their own
+                with self._lock:
+                    if self._render_locks.get(key) is render_lock:
+                        del self._render_locks[key]
+
+        return page
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,70 @@
+"""
+Process-wide config and database connections shared by every request.
+"""
+from threading import Lock
+
+from flask import g
+from werkzeug.wsgi import ClosingIterator
+
+from lib.config import ConfigCache
+from lib.db import SQLite, SQLitePool
+
+from ClimateControl import app
+
+CONFIG = ConfigCache()
+
+_pool = None
+_pool_config = None
+_pool_lock = Lock()
+
+def get_config():
+    """Returns the current Config, parsed again only after the conf files change"""
+    return CONFIG.get()
+
+def stream_port(config):
+    """Returns the port Web/streamserver.py listens on"""
+    return int(config.stream['bind'].rpartition(':')[2])
+
+def get_pool():
+    """Returns the read-only connection pool, replaced whenever the config is reloaded"""
+    global _pool, _pool_config
+
+    config = get_config()
+    with _pool_lock:
+        if _pool_config is not config:
+            if _pool:
+                _pool.close()
+
+            _pool = SQLitePool(
+                lambda: SQLite.from_config(config, readonly=True, check_same_thread=False),
+                size=config.web['db_pool_size'],
+                timeout=config.web['db_pool_timeout']
+                )
+            _pool_config = config
+
+        return _pool
+
+def get_db():
+    """Checks a read-only connection out of the pool for the rest of this request"""
+    if 'sqlite' not in g:
+        g.sqlite_pool = get_pool()
+        g.sqlite = g.sqlite_pool.checkout()
+
+    return g.sqlite
+
+def stream_db(generate, *args):
+    """Returns generate(cursor, *args) for a streamed response body, holding
+    a pooled connection until the server closes the response"""
+    pool = get_pool()
+    sqlite = pool.checkout()
+    try:
+        return ClosingIterator(generate(sqlite.cur, *args), lambda: pool.checkin(sqlite))
+    except:
+        pool.checkin(sqlite)
+        raise
+
+@app.teardown_appcontext
+def release_db(exception):
+    sqlite = g.pop('sqlite', None)
+    if sqlite is not None:
+        g.pop('sqlite_pool').checkin(sqlite)
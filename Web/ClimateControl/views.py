@@ -2,14 +2,18 @@
 Routes and views for the flask application.
 """
 import logging
+import numpy as np
+import os
 import traceback
 import sys
 
 from collections import OrderedDict
 from datetime import datetime, timedelta
-from flask import render_template, request
+from flask import abort, render_template, request, Response
+from werkzeug.wsgi import wrap_file
 
 from bokeh.embed import components
+from bokeh.models import ColumnDataSource
 from bokeh.models.axes import LinearAxis
 from bokeh.models.ranges import Range1d
 from bokeh.plotting import figure
@@ -18,15 +22,29 @@ from bokeh.themes.theme import Theme
 
 sys.path.append('/opt/ClimateControl/')
 
-import lib.controllers
-
-from lib.config import Config
-from lib.db import SQLite
+from lib.downsample import lttb_indices
+from lib.analytics import SAMPLE_PERIOD
+from lib.db import READING_COLUMNS, READING_VARIABLES, ROLLUP_TIERS
+from lib.query import bucket_arrays, select_buckets, select_latest, select_latest_reading
+from lib.rollup import select_tier
+from lib.variables import VARIABLES
 
 from ClimateControl import app
+from ClimateControl.assets import BokehAssets
+from ClimateControl.cache import RenderCache
+from ClimateControl.resources import get_config, get_db, stream_port
 
 logging.basicConfig(filename='ccweb.log', level=logging.DEBUG)
 
+# Chart width in pixels, also the point budget of each plotted series
+CHART_WIDTH = 800
+
+# Rendered pages keyed by (timespan, interval)
+RENDER_CACHE = RenderCache(16)
+
+# Content hashed BokehJS bundles served from /bokeh/
+BOKEH_ASSETS = BokehAssets('/bokeh/')
+
 @app.route('/')
 @app.route('/home')
 def home():
@@ -36,175 +54,251 @@ def home():
         timespan, interval = [int(data[i:i+2]) for i in range(0, len(data), 2)]
     else:
         timespan = int(request.args.get('timespan', 24))
-        interval = int(request.args.get('interval', 5))
+        interval = int(request.args.get('interval', 0))
     
     try:
-        config = Config()
-        sqlite = SQLite()
-        date_criteria = (datetime.utcnow() - timedelta(hours=timespan)).strftime('%Y%m%d%H%M')
-        query = "SELECT strftime('%Y', date), " \
-            "strftime('%j', date), " \
-            "strftime('%H', date), " \
-            "strftime('%M', date), " \
-            "avg(value), var, date " \
-            "FROM sensorout " \
-            "WHERE date >= DATETIME('now', '-" + str(timespan) + " hour') " \
-            "GROUP BY  strftime('%Y', date), value, var " \
-            "ORDER BY date ASC;"
-        app.logger.debug(query)
-        results = sqlite.cur.execute(query)
-
-        variables = dict()
-        for result in results:
-            app.logger.debug(result)
-            var = result[5]
-            ccv = getattr(lib.controllers, var)(None, None)
-            data = int(result[4])
-            date = datetime.strptime(result[6], '%Y-%m-%d %H:%M:%S.%f')
-            
-            if not variables.get(var):
-                variables[var] = {
-                    'x'         : [date],
-                    'y'         : [data],
-                    'variable'  : ccv
-                    }
-                    
-            else:
-                variables[var]['x'].append(date)
-                variables[var]['y'].append(data)
-                
-        variables = OrderedDict(sorted(variables.items(), key=lambda x: x[0]))
-        
-        # Initialize plot
-        plot = figure(
-            width           = 800,
-            x_axis_label    = 'DateTime',
-            x_axis_type     = 'datetime',
-            y_axis_type     = 'linear',
-            title           = 'Trending Environment Variables',
+        config = get_config()
+        sqlite = get_db()
+
+        # Pages are current until a newer sample arrives or the config changes
+        version = (select_latest(sqlite.cur), tuple(config.mtimes))
+        return RENDER_CACHE.get_or_render(
+            (timespan, interval), version,
+            lambda: render_dashboard(config, sqlite, timespan, interval)
             )
+    
+    except Exception as e:
+        app.logger.exception(e)
+        traceback.print_exc()
         
-        plot.axis[0].axis_label_text_color = "white"
-        plot.axis[0].axis_label_text_font_style = 'bold italic'
-        plot.axis[0].axis_line_color = "white"
-        plot.axis[0].major_label_text_color = "white"
-        plot.axis[0].major_tick_line_color = "white"
-        plot.axis[0].minor_tick_line_color = "white"
+    return render_template(
+        'index.html',
+        title='Climate Control Automation',
+        year=datetime.now().year,
+    )
+
+def bokeh_resources(config):
+    """Returns the BokehJS resources for the configured delivery mode"""
+    if config.web['bokeh_resources'] == 'static':
+        return BOKEH_ASSETS
+
+    return INLINE
+
+@app.route('/bokeh/<name>')
+def bokeh_asset(name):
+    """Serves a content hashed BokehJS file with long lived caching."""
+    asset = BOKEH_ASSETS.get(name)
+    if not asset:
+        abort(404)
+
+    path, etag = asset
+    headers = {
+        'Cache-Control' : 'public, max-age=31536000, immutable',
+        'ETag'          : '"{}"'.format(etag)
+        }
+
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    mimetype = 'text/css' if name.endswith('.css') else 'application/javascript'
+    headers['Content-Length'] = str(os.path.getsize(path))
+
+    return Response(
+        wrap_file(request.environ, open(path, 'rb')),
+        mimetype=mimetype,
+        headers=headers,
+        direct_passthrough=True
+        )
+
+def render_dashboard(config, sqlite, timespan, interval):
+    """Renders the ClimateControl page from the database."""
+    date_criteria = datetime.utcnow() - timedelta(hours=timespan)
+
+    # Aggregate into interval minute buckets, or when no interval was
+    # requested into the buckets of the coarsest rollup tier that still
+    # gives a detailed chart (1 second buckets being the raw readings)
+    if interval > 0:
+        bucket = interval * 60
+    else:
+        bucket = dict(ROLLUP_TIERS).get(select_tier(timespan * 3600), 1)
+    latest = select_latest_reading(sqlite.cur)
+    results = select_buckets(sqlite.cur, date_criteria, bucket=bucket)
+
+    buckets, arrays = bucket_arrays(results)
+
+    variables = dict()
+    for var, series in arrays.items():
+        valid = ~np.isnan(series['avg'])
+
+        # Reduce each series to one point per horizontal pixel
+        x = buckets[valid]
+        keep = lttb_indices(x.view(np.int64), series['avg'][valid], CHART_WIDTH)
+
+        variables[var] = {
+            'x'         : x[keep],
+            'y'         : series['avg'][valid][keep],
+            'y_min'     : series['min'][valid][keep],
+            'y_max'     : series['max'][valid][keep],
+            'variable'  : VARIABLES[var]
+            }
+
+    variables = {var: var_meta for var, var_meta in variables.items() if len(var_meta['x'])}
+    variables = OrderedDict(sorted(variables.items(), key=lambda x: x[0]))
+    
+    # Initialize plot
+    plot = figure(
+        width           = CHART_WIDTH,
+        x_axis_label    = 'DateTime',
+        x_axis_type     = 'datetime',
+        y_axis_type     = 'linear',
+        title           = 'Trending Environment Variables',
+        )
+    
+    plot.axis[0].axis_label_text_color = "white"
+    plot.axis[0].axis_label_text_font_style = 'bold italic'
+    plot.axis[0].axis_line_color = "white"
+    plot.axis[0].major_label_text_color = "white"
+    plot.axis[0].major_tick_line_color = "white"
+    plot.axis[0].minor_tick_line_color = "white"
+    
+    idx = 0
+    plots = list()
+    current_variables = list()
+    for var, var_meta in variables.items():
+        if var_meta['variable'].name == 'tempC':
+            continue
         
-        idx = 0
-        plots = list()
-        current_variables = list()
-        for var, var_meta in variables.items():
-            if var == 'tempC':
-                continue
-            
-            idx += 1
-            
-            current_variables.append({
-                'current_time': var_meta['x'][-1:][0].strftime("%Y/%m/%d %H:%M:%S"),
-                'current_measurement': round(var_meta['y'][-1:][0], 2),
-                'identity': var_meta['variable'].description,
-                'unit': var_meta['variable'].chart_unit
-                })
-
-            y_range_name = 'default'
-            if idx > 1:
-                y_range_name = var_meta['variable'].name
-                if idx == 2:
-                    plot.extra_y_ranges = {
-                        var_meta['variable'].name: Range1d(
-                            start=var_meta['variable'].chart_range_min, 
-                            end=var_meta['variable'].chart_range_max
-                            )
-                        }
-                else:
-                    plot.extra_y_ranges[var_meta['variable'].name] = Range1d(
+        idx += 1
+        
+        current_variables.append({
+            'name': var_meta['variable'].name,
+            'current_time': datetime.utcfromtimestamp(latest[0] / 1000).strftime("%Y/%m/%d %H:%M:%S"),
+            'current_measurement': round(latest[READING_COLUMNS.index(READING_VARIABLES[var])], 2),
+            'identity': var_meta['variable'].description,
+            'unit': var_meta['variable'].chart_unit
+            })
+
+        y_range_name = 'default'
+        if idx > 1:
+            y_range_name = var_meta['variable'].name
+            if idx == 2:
+                plot.extra_y_ranges = {
+                    var_meta['variable'].name: Range1d(
                         start=var_meta['variable'].chart_range_min, 
                         end=var_meta['variable'].chart_range_max
                         )
-                    
-                plot.add_layout(LinearAxis(
-                    y_range_name=var_meta['variable'].name,
-                    ), 'right')
-            # else:
-            #     plot.y_range = Range1d(
-            #         start=var_meta['variable'].chart_range_min,
-            #         end=var_meta['variable'].chart_range_max
-            #         )
-                
-            plot.axis[idx].axis_label = var_meta['variable'].description
-            plot.axis[idx].axis_label_text_color=var_meta['variable'].chart_color
-            plot.axis[idx].axis_label_text_font_style='bold italic'
-            plot.axis[idx].axis_line_color=var_meta['variable'].chart_color
-            plot.axis[idx].major_label_text_color=var_meta['variable'].chart_color
-            plot.axis[idx].major_tick_line_color=var_meta['variable'].chart_color
-            plot.axis[idx].minor_tick_line_color=var_meta['variable'].chart_color
-                
-            plot.line(
-                x=var_meta['x'],
-                y=var_meta['y'],
-                line_width=2,
-                color=var_meta['variable'].chart_color,
-                y_range_name=y_range_name,
-                legend_label=var_meta['variable'].description
-                )
-        
-        plot.toolbar.logo = None
-        plot.toolbar_location = "above"
-        plot.legend.location  = 'bottom_center'
-        plot.legend.orientation = "horizontal"
-        plot.legend.click_policy = 'mute'
-        plot.legend.background_fill_color = "#2F2F2F"
-        plot.legend.border_line_color = "white"
-        plot.legend.label_text_color = "white"
-
-        plots.append(plot)
+                    }
+            else:
+                plot.extra_y_ranges[var_meta['variable'].name] = Range1d(
+                    start=var_meta['variable'].chart_range_min, 
+                    end=var_meta['variable'].chart_range_max
+                    )
                 
-        current_variables = sorted(current_variables, key=lambda d: d['identity'])
+            plot.add_layout(LinearAxis(
+                y_range_name=var_meta['variable'].name,
+                ), 'right')
+        # else:
+        #     plot.y_range = Range1d(
+        #         start=var_meta['variable'].chart_range_min,
+        #         end=var_meta['variable'].chart_range_max
+        #         )
             
-        # Get Chart Components
-        theme = Theme(json={
-            'attrs' : {
-                'Plot': {
-                    'background_fill_color': '#2F2F2F',
-                    'border_fill_color': '#2F2F2F',
-                    'outline_line_color': 'white',
-                },
-                'Axis': {
-                    'axis_line_color': None,
-                },
-                'Grid': {
-                    'grid_line_dash': [6, 4],
-                    'grid_line_alpha': .3,
+        plot.axis[idx].axis_label = var_meta['variable'].description
+        plot.axis[idx].axis_label_text_color=var_meta['variable'].chart_color
+        plot.axis[idx].axis_label_text_font_style='bold italic'
+        plot.axis[idx].axis_line_color=var_meta['variable'].chart_color
+        plot.axis[idx].major_label_text_color=var_meta['variable'].chart_color
+        plot.axis[idx].major_tick_line_color=var_meta['variable'].chart_color
+        plot.axis[idx].minor_tick_line_color=var_meta['variable'].chart_color
+            
+        # Named so the page can stream new readings into it
+        source = ColumnDataSource(
+            data={
+                'x'     : var_meta['x'],
+                'y'     : var_meta['y'],
+                'y_min' : var_meta['y_min'],
+                'y_max' : var_meta['y_max']
                 },
-                'Title': {
-                    'text_color': 'white'
-                }
-            }
-        })
-        script, div = components(plots, theme=theme)
-
-        # grab the static resources
-        js_resources = INLINE.render_js()
-        css_resources = INLINE.render_css()
-
-        # Return the components to the HTML template
-        return render_template(
-            'index.html',
-            title='Climate Control Automation',
-            plot_script=script,
-            plot_divs=div,
-            js_resources=js_resources,
-            css_resources=css_resources,
-            current_variables=current_variables
-        )
+            name='readings_{}'.format(var_meta['variable'].name)
+            )
+
+        plot.varea(
+            x='x',
+            y1='y_min',
+            y2='y_max',
+            source=source,
+            fill_alpha=0.2,
+            fill_color=var_meta['variable'].chart_color,
+            y_range_name=y_range_name
+            )
+
+        plot.line(
+            x='x',
+            y='y',
+            source=source,
+            line_width=2,
+            color=var_meta['variable'].chart_color,
+            y_range_name=y_range_name,
+            legend_label=var_meta['variable'].description
+            )
     
-    except Exception as e:
-        app.logger.exception(e)
-        traceback.print_exc()
+    plot.toolbar.logo = None
+    plot.toolbar_location = "above"
+    plot.legend.location  = 'bottom_center'
+    plot.legend.orientation = "horizontal"
+    plot.legend.click_policy = 'mute'
+    plot.legend.background_fill_color = "#2F2F2F"
+    plot.legend.border_line_color = "white"
+    plot.legend.label_text_color = "white"
+
+    plots.append(plot)
+            
+    current_variables = sorted(current_variables, key=lambda d: d['identity'])
         
+    # Get Chart Components
+    theme = Theme(json={
+        'attrs' : {
+            'Plot': {
+                'background_fill_color': '#2F2F2F',
+                'border_fill_color': '#2F2F2F',
+                'outline_line_color': 'white',
+            },
+            'Axis': {
+                'axis_line_color': None,
+            },
+            'Grid': {
+                'grid_line_dash': [6, 4],
+                'grid_line_alpha': .3,
+            },
+            'Title': {
+                'text_color': 'white'
+            }
+        }
+    })
+    script, div = components(plots, theme=theme)
+
+    # grab the static resources
+    resources = bokeh_resources(config)
+    js_resources = resources.render_js()
+    css_resources = resources.render_css()
+
+    # Return the components to the HTML template
     return render_template(
         'index.html',
         title='Climate Control Automation',
-        year=datetime.now().year,
-    )
\ No newline at end of file
+        plot_script=script,
+        plot_divs=div,
+        js_resources=js_resources,
+        css_resources=css_resources,
+        current_variables=current_variables,
+        readings_cursor=latest[0] if latest else None,
+        readings_poll=config.web['poll_interval'],
+        readings_stream=config.stream['enabled'],
+        readings_stream_url=config.stream['url'],
+        readings_stream_port=stream_port(config),
+        # Live samples are averaged into points as far apart as the rendered
+        # ones, and points older than the timespan are dropped
+        readings_bucket=max(bucket, timespan * 3600 // CHART_WIDTH) * 1000,
+        readings_timespan=timespan * 3600 * 1000,
+        readings_sample=SAMPLE_PERIOD * 1000
+    )
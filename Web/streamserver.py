@@ -0,0 +1,322 @@
+"""
+This script serves /api/stream, the Server-Sent Events stream of live daemon
+events, next to the gunicorn web server.  One thread multiplexes every client
+connection and the daemon's event socket with a selector, so an idle
+dashboard costs an open socket rather than a server thread.  It is
+configured from the [stream] section of ClimateControl.conf, and the web
+application redirects /api/stream here.
+"""
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+
+from collections import deque
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from lib.config import Config
+from lib.log import log_init
+
+log = logging.getLogger()
+
+STREAM_PATH = '/api/stream'
+
+# Largest request header block accepted, and seconds allowed to send it
+MAX_REQUEST = 8192
+REQUEST_TIMEOUT = 10
+
+# Bytes queued for a client that has stopped reading before it is dropped
+MAX_BACKLOG = 256 * 1024
+
+STREAM_HEADERS = (
+    'HTTP/1.1 200 OK\r\n'
+    'Content-Type: text/event-stream\r\n'
+    'Cache-Control: no-cache\r\n'
+    'Access-Control-Allow-Origin: *\r\n'
+    'X-Accel-Buffering: no\r\n'
+    'Connection: close\r\n'
+    '\r\n'
+    'retry: 5000\n\n'
+    ).encode('latin-1')
+
+def error_response(status, text, headers=''):
+    body = text.encode('utf-8')
+    return (
+        'HTTP/1.1 {}\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Length: {}\r\n{}Connection: close\r\n\r\n'.format(
+            status, len(body), headers
+            ).encode('latin-1') + body
+        )
+
+def event_message(seq, event_type, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(seq, event_type, data).encode('utf-8')
+
+class Client(object):
+    """A connection from its request until it is closed"""
+    def __init__(self, sock, now):
+        self.sock = sock
+        self.request = bytearray()
+        self.output = bytearray()
+        self.streaming = False
+        self.closing = False
+        self.last_write = now
+        self.deadline = now + REQUEST_TIMEOUT
+
+class StreamServer(object):
+    """Receives the daemon's events on a unix datagram socket in socket_dir and
+    fans each one out to every connected client from a single thread.  A
+    short history lets a reconnecting client resume from its Last-Event-ID,
+    idle streams get a keepalive comment every keepalive seconds, and clients
+    that stop reading are dropped once MAX_BACKLOG bytes are queued for them.
+    Connections past max_clients are answered with 503."""
+    def __init__(self, address, socket_dir, size=256, max_clients=64, keepalive=15):
+        host, _, port = address.rpartition(':')
+        self.address = (host or '0.0.0.0', int(port))
+        self.socket_dir = socket_dir
+        self.max_clients = max_clients
+        self.keepalive = keepalive
+
+        self.events = deque(maxlen=size)
+        self.seq = 0
+        self.path = None
+        self.clients = dict()
+        self.dropped = 0
+
+        self._selector = selectors.DefaultSelector()
+        self._listener = None
+        self._sock = None
+        self._running = False
+
+    def start(self):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(self.address)
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+        self.address = self._listener.getsockname()
+        self._selector.register(self._listener, selectors.EVENT_READ, 'accept')
+
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.path = os.path.join(self.socket_dir, 'stream-{}.sock'.format(os.getpid()))
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._sock.setblocking(False)
+        self._selector.register(self._sock, selectors.EVENT_READ, 'event')
+
+    def serve_forever(self, interval=1.0):
+        """Polls every interval seconds at most until stop() is called"""
+        self._running = True
+        while self._running:
+            self.poll(interval)
+
+    def stop(self):
+        self._running = False
+
+    def poll(self, timeout):
+        """Handles whatever is ready within timeout seconds, then sends due
+        keepalives and drops clients that never sent a request"""
+        for key, mask in self._selector.select(timeout):
+            if key.data == 'accept':
+                self._accept()
+            elif key.data == 'event':
+                self._receive()
+            elif key.data.sock.fileno() >= 0:
+                if mask & selectors.EVENT_READ:
+                    self._read(key.data)
+                if mask & selectors.EVENT_WRITE and key.data.sock.fileno() >= 0:
+                    self._flush(key.data)
+
+        now = time.monotonic()
+        for client in list(self.clients.values()):
+            if client.streaming:
+                if not client.output and now - client.last_write >= self.keepalive:
+                    self._send(client, b': keepalive\n\n')
+            elif now >= client.deadline:
+                self._drop(client)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                log.warning('Failed to accept a stream connection: {}'.format(e))
+                return
+
+            sock.setblocking(False)
+            client = Client(sock, time.monotonic())
+            self.clients[sock.fileno()] = client
+            self._selector.register(sock, selectors.EVENT_READ, client)
+
+            if len(self.clients) > self.max_clients:
+                self._finish(client, error_response('503 Service Unavailable', 'Too many live streams are open', 'Retry-After: 60\r\n'))
+
+    def _receive(self):
+        while True:
+            try:
+                payload = self._sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                log.warning('Failed to receive a live event: {}'.format(e))
+                return
+
+            try:
+                data = payload.decode('utf-8')
+                event_type = json.loads(data)['type']
+            except Exception:
+                log.warning('Dropping malformed live event {!r}'.format(payload[:200]))
+                continue
+
+            self.seq += 1
+            self.events.append((self.seq, event_type, data))
+
+            message = event_message(self.seq, event_type, data)
+            for client in list(self.clients.values()):
+                if client.streaming:
+                    self._send(client, message)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self._drop(client)
+        elif not client.streaming and not client.closing:
+            client.request += data
+            if b'\r\n\r\n' in client.request:
+                self._respond(client)
+            elif len(client.request) > MAX_REQUEST:
+                self._finish(client, error_response('431 Request Header Fields Too Large', 'Request headers are too large'))
+
+    def _respond(self, client):
+        lines = client.request.split(b'\r\n\r\n', 1)[0].decode('latin-1').split('\r\n')
+        request_line = lines[0].split()
+        if len(request_line) != 3:
+            self._finish(client, error_response('400 Bad Request', 'Malformed request'))
+            return
+
+        method, target, _ = request_line
+        if target.split('?', 1)[0] != STREAM_PATH:
+            self._finish(client, error_response('404 Not Found', 'Not found'))
+            return
+        if method != 'GET':
+            self._finish(client, error_response('405 Method Not Allowed', 'Method not allowed', 'Allow: GET\r\n'))
+            return
+
+        last_id = None
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'last-event-id':
+                try:
+                    last_id = int(value.strip())
+                except ValueError:
+                    pass
+
+        # Sequence numbers restart with the process
+        cursor = self.seq if last_id is None or last_id > self.seq else last_id
+
+        client.streaming = True
+        client.request = None
+        self._send(client, STREAM_HEADERS + b''.join(
+            event_message(*event) for event in self.events if event[0] > cursor
+            ))
+
+    def _finish(self, client, response):
+        # Answered without a stream, closed once the response is written
+        client.closing = True
+        self._send(client, response)
+
+    def _send(self, client, data):
+        client.output += data
+        self._flush(client)
+
+    def _flush(self, client):
+        try:
+            sent = client.sock.send(client.output)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._drop(client)
+            return
+
+        if sent:
+            del client.output[:sent]
+            client.last_write = time.monotonic()
+
+        if not client.output and client.closing:
+            self._drop(client)
+        elif len(client.output) > MAX_BACKLOG:
+            log.warning('Dropping a live stream client {} bytes behind'.format(len(client.output)))
+            self.dropped += 1
+            self._drop(client)
+        else:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.output else 0)
+            if self._selector.get_key(client.sock).events != events:
+                self._selector.modify(client.sock, events, client)
+
+    def _drop(self, client):
+        if client.sock.fileno() < 0:
+            return
+
+        self.clients.pop(client.sock.fileno(), None)
+        self._selector.unregister(client.sock)
+        client.sock.close()
+
+    def close(self):
+        for client in list(self.clients.values()):
+            self._drop(client)
+
+        for sock in [self._listener, self._sock]:
+            if sock:
+                self._selector.unregister(sock)
+                sock.close()
+        self._listener = self._sock = None
+        self._selector.close()
+
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+def main():
+    settings = Config().stream
+    if not settings['enabled']:
+        log.error('Live streams are disabled in [stream]')
+        return
+
+    server = StreamServer(
+        os.environ.get('STREAM_BIND', settings['bind']),
+        settings['socket_dir'],
+        size=settings['buffer'],
+        max_clients=settings['max_clients'],
+        keepalive=settings['keepalive']
+        )
+    server.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+
+    log.info('Serving live streams on {}:{}'.format(*server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info('Dropped {} live stream clients that fell behind'.format(server.dropped))
+        server.close()
+
+if __name__ == '__main__':
+    log_init('console', level=logging.INFO)
+    main()
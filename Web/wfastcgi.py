@@ -22,20 +22,27 @@ import ctypes
 import datetime
 import os
 import re
+import select
 import struct
 import sys
+import tempfile
+import threading
+import time
 import traceback
 from xml.dom import minidom
 
 try:
     from cStringIO import StringIO
-    BytesIO = StringIO
 except ImportError:
-    from io import StringIO, BytesIO
+    from io import StringIO
 try:
     from thread import start_new_thread
 except ImportError:
     from _thread import start_new_thread
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 
 if sys.version_info[0] == 3:
     def to_str(value):
@@ -96,6 +103,103 @@ class FastCgiRecord(object):
                                                     self.role, 
                                                     self.flags)
 
+# Bytes buffered when reading records, room for a complete record or more
+FCGI_BUFFER_SIZE = 128 * 1024
+
+class FastCgiStream(object):
+    """The connection to the web server.  Records are read through one
+    reusable buffer, filled by as few reads as the data arrives in.  Records
+    of multiplexed requests are interleaved on it, so every batch of records
+    is written under write_lock."""
+    def __init__(self, stream, buffer_size=FCGI_BUFFER_SIZE):
+        self.stream = stream
+        self.write_lock = threading.Lock()
+
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = self._end = 0
+        # readinto1 returns whatever one read delivers instead of blocking
+        # until the whole buffer is full
+        self._readinto = getattr(stream, 'readinto1', None) or stream.readinto
+
+    def _fill(self, size):
+        if self._end - self._start >= size:
+            return
+
+        # move the unread tail to the front to make room
+        length = self._end - self._start
+        if self._start:
+            self._view[:length] = self._view[self._start:self._end]
+            self._start, self._end = 0, length
+
+        while self._end < size:
+            count = self._readinto(self._view[self._end:])
+            if not count:
+                return
+            self._end += count
+
+    def read_view(self, size):
+        """returns a memoryview of the next size bytes, which is only valid
+        until the next read and shorter only at the end of the stream.  The
+        next read may move or overwrite the bytes behind it, so anything
+        kept past it must be copied."""
+        self._fill(size)
+        size = min(size, self._end - self._start)
+        view = self._view[self._start:(self._start + size)]
+        self._start += size
+        return view
+
+    def read(self, size):
+        return self.read_view(size).tobytes()
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def flush(self):
+        self.stream.flush()
+
+class RequestPool(object):
+    """Bounded pool of threads running requests.  submit blocks while every
+    thread is busy and as many requests are waiting, which stops reading new
+    records from the web server until one finishes."""
+    def __init__(self, size):
+        self.size = size
+        self.queue = Queue(size)
+        for _ in range(size):
+            worker = threading.Thread(target=self._run)
+            worker.daemon = True
+            worker.start()
+
+    def _run(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except BaseException:
+                maybe_log('Unhandled exception in wfastcgi.py request thread: ' + traceback.format_exc())
+
+    def submit(self, func, *args):
+        self.queue.put((func, args))
+
+class RequestOutput(object):
+    """Stands in for sys.stdout and sys.stderr so output printed while
+    handling a request is captured for that request only, whichever thread
+    it runs on."""
+    def __init__(self):
+        self._local = threading.local()
+
+    def begin(self):
+        self._local.buffer = StringIO()
+        return self._local.buffer
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.write(text)
+
+    def flush(self):
+        pass
+
 #typedef struct {
 #   unsigned char version;
 #   unsigned char type;
@@ -162,12 +266,17 @@ def read_fastcgi_record(stream):
 
     fcgi_ver, reqtype, req_id, content_size, padding_len, _ = struct.unpack('>BBHHBB', data)
 
-    content = stream.read(content_size)  # read content
-    stream.read(padding_len)
+    # content and padding are read as one block, a second read could refill
+    # the buffer behind the content view before it is processed
+    content = stream.read_view(content_size + padding_len)[:content_size]
 
     if fcgi_ver != FCGI_VERSION_1:
         raise Exception('Unknown fastcgi version %s' % fcgi_ver)
 
+    if req_id and reqtype != FCGI_BEGIN_REQUEST and req_id not in _REQUESTS:
+        # the rest of a request that was refused
+        return None
+
     processor = REQUEST_PROCESSORS.get(reqtype)
     if processor is not None:
         return processor(stream, req_id, content)
@@ -188,6 +297,11 @@ def read_fastcgi_begin_request(stream, req_id, content):
     #        unsigned char reserved[5];
     #    } FCGI_BeginRequestBody;
 
+    if _RESTART_PENDING.is_set():
+        # not started in a process that is about to exit
+        send_response(stream, req_id, FCGI_END_REQUEST, struct.pack('>IB3x', 0, FCGI_OVERLOADED), streaming=False)
+        return
+
     # TODO: Ignore request if it exists
     res = FastCgiRecord(
         FCGI_BEGIN_REQUEST,
@@ -260,6 +374,7 @@ def read_fastcgi_params(stream, req_id, content):
     if not content:
         return None
 
+    content = content.tobytes()
     offset = 0
     res = _REQUESTS[req_id].params
     while offset < len(content):
@@ -272,16 +387,17 @@ def read_fastcgi_params(stream, req_id, content):
 
 
 def read_fastcgi_input(stream, req_id, content):
-    """reads FastCGI std-in and stores it in wsgi.input passed in the
-    wsgi environment array"""
+    """reads FastCGI std-in into wsgi.input passed in the wsgi environment
+    array, a file kept in memory until it grows past INPUT_SPOOL_SIZE"""
     res = _REQUESTS[req_id].params
     if 'wsgi.input' not in res:
-        res['wsgi.input'] = content
-    else:
-        res['wsgi.input'] += content
+        res['wsgi.input'] = tempfile.SpooledTemporaryFile(max_size=INPUT_SPOOL_SIZE)
 
-    if not content:
+    if content:
+        res['wsgi.input'].write(content)
+    else:
         # we've hit the end of the input stream, time to process input...
+        res['wsgi.input'].seek(0)
         return _REQUESTS[req_id]
 
 
@@ -289,9 +405,8 @@ def read_fastcgi_data(stream, req_id, content):
     """reads FastCGI data stream and publishes it as wsgi.data"""
     res = _REQUESTS[req_id].params
     if 'wsgi.data' not in res:
-        res['wsgi.data'] = content
-    else:
-        res['wsgi.data'] += content
+        res['wsgi.data'] = bytearray()
+    res['wsgi.data'] += content
 
 
 def read_fastcgi_abort_request(stream, req_id, content):
@@ -303,21 +418,22 @@ def read_fastcgi_abort_request(stream, req_id, content):
 def read_fastcgi_get_values(stream, req_id, content):
     """reads the fastcgi request to get parameter values, and immediately 
     responds"""
+    content = content.tobytes()
     offset = 0
     request = {}
     while offset < len(content):
         offset, name, value = read_fastcgi_keyvalue_pairs(content, offset)
-        request[name] = value
+        request[wsgi_decode(name)] = value
 
     response = {}
     if FCGI_MAX_CONNS in request:
         response[FCGI_MAX_CONNS] = '1'
 
     if FCGI_MAX_REQS in request:
-        response[FCGI_MAX_REQS] = '1'
+        response[FCGI_MAX_REQS] = str(MAX_REQUESTS)
 
     if FCGI_MPXS_CONNS in request:
-        response[FCGI_MPXS_CONNS] = '0'
+        response[FCGI_MPXS_CONNS] = '1' if MAX_REQUESTS > 1 else '0'
 
     send_response(
         stream,
@@ -362,18 +478,46 @@ def maybe_log(txt):
     except:
         pass
 
+# Records framed into a single os.writev call, well below the usual IOV_MAX
+WRITEV_RECORDS = 64
+
+def write_buffers(fd, buffers):
+    """writes every buffer to fd, gathering them into as few os.writev calls
+    as possible.  Platforms without writev (Windows) get one joined write."""
+    if not hasattr(os, 'writev'):
+        buffers = [memoryview(b''.join(buffers))]
+        while buffers[0]:
+            buffers[0] = buffers[0][os.write(fd, buffers[0]):]
+        return
+
+    while buffers:
+        written = os.writev(fd, buffers)
+
+        # drop what was written and resume a partial write where it stopped
+        index = 0
+        while index < len(buffers) and written >= len(buffers[index]):
+            written -= len(buffers[index])
+            index += 1
+        buffers = buffers[index:]
+        if written:
+            buffers[0] = memoryview(buffers[0])[written:]
+
 def send_response(stream, req_id, resp_type, content, streaming=True):
     """sends a response w/ the given id, type, and content to the server.
     If the content is streaming then an empty record is sent at the end to 
-    terminate the stream"""
+    terminate the stream.  Records are framed around memoryview slices of
+    content, so the payload is never copied, and written in batches that
+    other requests' records cannot interleave with."""
     if not isinstance(content, bytes):
         raise TypeError("content must be encoded before sending: %r" % content)
     
+    view = memoryview(content)
+    buffers = []
     offset = 0
     while True:
-        len_remaining = max(min(len(content) - offset, 0xFFFF), 0)
+        len_remaining = max(min(len(view) - offset, 0xFFFF), 0)
 
-        data = struct.pack(
+        buffers.append(struct.pack(
             '>BBHHBB',
             FCGI_VERSION_1,     # version
             resp_type,          # type
@@ -381,14 +525,20 @@ def send_response(stream, req_id, resp_type, content, streaming=True):
             len_remaining,      # contentLengthB1:B0
             0,                  # paddingLength
             0,                  # reserved
-        ) + content[offset:(offset + len_remaining)]
+        ))
+        if len_remaining:
+            buffers.append(view[offset:(offset + len_remaining)])
 
         offset += len_remaining
 
-        os.write(stream.fileno(), data)
-        if len_remaining == 0 or not streaming:
+        done = len_remaining == 0 or not streaming
+        if done or len(buffers) >= WRITEV_RECORDS * 2:
+            with stream.write_lock:
+                write_buffers(stream.fileno(), buffers)
+                stream.flush()
+            buffers = []
+        if done:
             break
-    stream.flush()
 
 def get_environment(dir):
     web_config = os.path.join(dir, 'Web.config')
@@ -409,50 +559,52 @@ def get_environment(dir):
                     d[key.strip()] = value
     return d
 
-ReadDirectoryChangesW = ctypes.windll.kernel32.ReadDirectoryChangesW
-ReadDirectoryChangesW.restype = ctypes.c_uint32
-ReadDirectoryChangesW.argtypes  = [
-    ctypes.c_void_p,     # HANDLE hDirectory
-    ctypes.c_void_p,     # LPVOID lpBuffer
-    ctypes.c_uint32,     # DWORD nBufferLength
-    ctypes.c_uint32,     # BOOL bWatchSubtree
-    ctypes.c_uint32,     # DWORD dwNotifyFilter
-    ctypes.POINTER(ctypes.c_uint32),  # LPDWORD lpBytesReturned
-    ctypes.c_void_p,     # LPOVERLAPPED lpOverlapped
-    ctypes.c_void_p      # LPOVERLAPPED_COMPLETION_ROUTINE lpCompletionRoutine
-]
-try:
-    from _winapi import (CreateFile, CloseHandle, GetLastError, ExitProcess,
-                         WaitForSingleObject, INFINITE, OPEN_EXISTING)
-except ImportError:
-    CreateFile = ctypes.windll.kernel32.CreateFileW
-    CreateFile.restype = ctypes.c_void_p
-    CreateFile.argtypes  = [
-        ctypes.c_wchar_p,     # lpFilename
-        ctypes.c_uint32,      # dwDesiredAccess
-        ctypes.c_uint32,      # dwShareMode
-        ctypes.c_void_p,      # LPSECURITY_ATTRIBUTES,
-        ctypes.c_uint32,      # dwCreationDisposition,
-        ctypes.c_uint32,      # dwFlagsAndAttributes,
-        ctypes.c_void_p       # hTemplateFile
+# The Windows API behind the ReadDirectoryChangesW file watcher
+if sys.platform == 'win32':
+    ReadDirectoryChangesW = ctypes.windll.kernel32.ReadDirectoryChangesW
+    ReadDirectoryChangesW.restype = ctypes.c_uint32
+    ReadDirectoryChangesW.argtypes  = [
+        ctypes.c_void_p,     # HANDLE hDirectory
+        ctypes.c_void_p,     # LPVOID lpBuffer
+        ctypes.c_uint32,     # DWORD nBufferLength
+        ctypes.c_uint32,     # BOOL bWatchSubtree
+        ctypes.c_uint32,     # DWORD dwNotifyFilter
+        ctypes.POINTER(ctypes.c_uint32),  # LPDWORD lpBytesReturned
+        ctypes.c_void_p,     # LPOVERLAPPED lpOverlapped
+        ctypes.c_void_p      # LPOVERLAPPED_COMPLETION_ROUTINE lpCompletionRoutine
     ]
-
-    CloseHandle = ctypes.windll.kernel32.CloseHandle
-    CloseHandle.argtypes = [ctypes.c_void_p]
-
-    GetLastError = ctypes.windll.kernel32.GetLastError
-    GetLastError.restype = ctypes.c_uint32
-
-    ExitProcess = ctypes.windll.kernel32.ExitProcess
-    ExitProcess.restype = ctypes.c_void_p
-    ExitProcess.argtypes  = [ctypes.c_uint32]
-
-    WaitForSingleObject = ctypes.windll.kernel32.WaitForSingleObject
-    WaitForSingleObject.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
-    WaitForSingleObject.restype = ctypes.c_uint32
-
-    OPEN_EXISTING = 3
-    INFINITE = -1
+    try:
+        from _winapi import (CreateFile, CloseHandle, GetLastError, ExitProcess,
+                             WaitForSingleObject, INFINITE, OPEN_EXISTING)
+    except ImportError:
+        CreateFile = ctypes.windll.kernel32.CreateFileW
+        CreateFile.restype = ctypes.c_void_p
+        CreateFile.argtypes  = [
+            ctypes.c_wchar_p,     # lpFilename
+            ctypes.c_uint32,      # dwDesiredAccess
+            ctypes.c_uint32,      # dwShareMode
+            ctypes.c_void_p,      # LPSECURITY_ATTRIBUTES,
+            ctypes.c_uint32,      # dwCreationDisposition,
+            ctypes.c_uint32,      # dwFlagsAndAttributes,
+            ctypes.c_void_p       # hTemplateFile
+        ]
+
+        CloseHandle = ctypes.windll.kernel32.CloseHandle
+        CloseHandle.argtypes = [ctypes.c_void_p]
+
+        GetLastError = ctypes.windll.kernel32.GetLastError
+        GetLastError.restype = ctypes.c_uint32
+
+        ExitProcess = ctypes.windll.kernel32.ExitProcess
+        ExitProcess.restype = ctypes.c_void_p
+        ExitProcess.argtypes  = [ctypes.c_uint32]
+
+        WaitForSingleObject = ctypes.windll.kernel32.WaitForSingleObject
+        WaitForSingleObject.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        WaitForSingleObject.restype = ctypes.c_uint32
+
+        OPEN_EXISTING = 3
+        INFINITE = -1
 
 FILE_LIST_DIRECTORY = 1
 FILE_SHARE_READ = 0x00000001
@@ -464,6 +616,23 @@ FILE_NOTIFY_CHANGE_LAST_WRITE  = 0x10
 ERROR_NOTIFY_ENUM_DIR = 1022
 INVALID_HANDLE_VALUE = 0xFFFFFFFF
 
+# inotify(7) flags for the Linux file watcher
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ONLYDIR      = 0x01000000
+IN_ISDIR        = 0x40000000
+IN_CLOEXEC      = 0o2000000
+INOTIFY_EVENT   = struct.Struct('iIII')
+
+# Seconds without further changes before a burst of them restarts the process
+RESTART_DEBOUNCE = 1.0
+
+# Seconds a restart waits for requests in flight to finish
+RESTART_TIMEOUT = 30
+
 class FILE_NOTIFY_INFORMATION(ctypes.Structure):
     _fields_ = [('NextEntryOffset', ctypes.c_uint32),
                 ('Action', ctypes.c_uint32),
@@ -499,12 +668,100 @@ def on_exit(task):
             start_new_thread(_wait_for_exit, ())
     _ON_EXIT_TASKS.append(task)
 
-def start_file_watcher(path, restart_regex):
+# Set once the process is going to recycle, new requests are refused from then on
+_RESTART_PENDING = threading.Event()
+
+def recycle(stream):
+    """exits once the requests in flight have finished, so the web server
+    starts a fresh process for the next one.  Requests still open after
+    RESTART_TIMEOUT are ended with an error status rather than cut off."""
+    _RESTART_PENDING.set()
+    deadline = time.time() + RESTART_TIMEOUT
+    while _REQUESTS and time.time() < deadline:
+        time.sleep(0.1)
+
+    for req_id in list(_REQUESTS):
+        maybe_log('wfastcgi.py ending request %s, still open after %ss' % (req_id, RESTART_TIMEOUT))
+        send_response(stream, req_id, FCGI_END_REQUEST, struct.pack('>IB3x', 1, FCGI_REQUEST_COMPLETE), streaming=False)
+
+    run_exit_tasks()
+    os._exit(0)
+
+def start_inotify_watcher(path, restart_regex, stream):
+    """Linux counterpart of the ReadDirectoryChangesW watcher.  Blocks on an
+    inotify descriptor watching every directory under path, lets a burst of
+    changes settle and then recycles the process."""
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = libc.inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        maybe_log("Unable to create watcher: %s" % os.strerror(ctypes.get_errno()))
+        return
+
+    # watch descriptor to directory relative to path
+    watches = {}
+    def add_watches(root):
+        for dirpath, _, _ in os.walk(root):
+            wd = libc.inotify_add_watch(
+                fd, os.fsencode(dirpath), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+            )
+            if wd < 0:
+                maybe_log("Unable to watch %s: %s" % (dirpath, os.strerror(ctypes.get_errno())))
+            else:
+                watches[wd] = os.path.relpath(dirpath, path)
+
+    def enum_changes():
+        """Returns a generator that blocks until a change occurs, then yields
+        the filename of the changed file relative to path.
+
+        Yields an empty string if the kernel dropped events."""
+        while True:
+            data = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[(offset + INOTIFY_EVENT.size):(offset + INOTIFY_EVENT.size + length)].rstrip(b'\0'))
+                offset += INOTIFY_EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    yield ''
+                elif mask & IN_IGNORED:
+                    watches.pop(wd, None)
+                elif wd in watches:
+                    filename = os.path.normpath(os.path.join(watches[wd], name))
+                    if mask & IN_ISDIR:
+                        add_watches(os.path.join(path, filename))
+                    elif not mask & IN_CREATE:
+                        yield filename
+
+    log('wfastcgi.py will restart when files in %s are changed: %s' % (path, restart_regex))
+    def watcher(restart):
+        for filename in enum_changes():
+            if not filename:
+                log('wfastcgi.py exiting because file change events were lost')
+            elif restart.match(filename):
+                log('wfastcgi.py exiting because %s has changed, matching %s' % (filename, restart_regex))
+            else:
+                continue
+
+            # wait for the rest of a burst, such as a deployment, to settle
+            while select.select([fd], [], [], RESTART_DEBOUNCE)[0]:
+                os.read(fd, 64 * 1024)
+            recycle(stream)
+
+    add_watches(path)
+    start_new_thread(watcher, (re.compile(restart_regex), ))
+
+def start_file_watcher(path, restart_regex, stream):
     if restart_regex is None:
         restart_regex = ".*((\\.py)|(\\.config))$"
     elif not restart_regex:
         # restart regex set to empty string, no restart behavior
         return
+
+    if sys.platform != 'win32':
+        return start_inotify_watcher(path, restart_regex, stream)
     
     def enum_changes(path):
         """Returns a generator that blocks until a change occurs, then yields
@@ -666,11 +923,10 @@ class handle_response(object):
 
     def __enter__(self):
         record = self.record
-        record.params['wsgi.input'] = BytesIO(record.params['wsgi.input'])
         record.params['wsgi.version'] = (1, 0)
         record.params['wsgi.url_scheme'] = 'https' if record.params.get('HTTPS', '').lower() == 'on' else 'http'
         record.params['wsgi.multiprocess'] = True
-        record.params['wsgi.multithread'] = False
+        record.params['wsgi.multithread'] = MAX_REQUESTS > 1
         record.params['wsgi.run_once'] = False
 
         self.physical_path = record.params.get('APPL_PHYSICAL_PATH', os.path.dirname(__file__))
@@ -704,12 +960,14 @@ class handle_response(object):
             # error.
             maybe_log(error_msg)
 
+        # Remove the request from our global dict before ending it, the web
+        # server may reuse its id as soon as it sees the end of the request
+        del _REQUESTS[self.record.req_id]
+        self.record.params['wsgi.input'].close()
+
         # End the request. This has to run in both success and failure cases.
         self.send(FCGI_END_REQUEST, zero_bytes(8), streaming=False)
         
-        # Remove the request from our global dict
-        del _REQUESTS[self.record.req_id]
-        
         # Suppress all exceptions unless requested
         return not self.fatal_errors
 
@@ -757,8 +1015,114 @@ class handle_response(object):
 
 _REQUESTS = {}
 
+# Requests handled at once, multiplexed over the web server connection.  Set
+# WSGI_MAX_REQUESTS=1 in the FastCGI process environment to handle them one
+# at a time.
+try:
+    MAX_REQUESTS = max(int(os.environ.get('WSGI_MAX_REQUESTS', 8)), 1)
+except ValueError:
+    MAX_REQUESTS = 1
+
+# Request bodies larger than this many bytes are spooled to a temporary file
+try:
+    INPUT_SPOOL_SIZE = int(os.environ.get('WSGI_INPUT_SPOOL_SIZE', 1024 * 1024))
+except ValueError:
+    INPUT_SPOOL_SIZE = 1024 * 1024
+
+REQUEST_OUTPUT = RequestOutput()
+REQUEST_ERRORS = RequestOutput()
+
+# (env, handler) once the first request has initialized the process
+_APPLICATION = None
+
+def initialize(response):
+    """reads the WSGI handler and starts the file watcher, on the first request"""
+    log('wfastcgi.py %s initializing' % __version__)
+
+    os.chdir(response.physical_path)
+    sys.path[0] = '.'
+
+    # Initialization errors should be treated as fatal.
+    response.fatal_errors = True
+    response.error_message = 'Error occurred while reading WSGI handler'
+    env, handler = read_wsgi_handler(response.physical_path)
+
+    response.error_message = 'Error occurred starting file watcher'
+    start_file_watcher(response.physical_path, env.get('WSGI_RESTART_FILE_REGEX'), response.stream)
+
+    # Enable debugging if possible. Default to local-only, but
+    # allow a web.config to override where we listen
+    ptvsd_secret = env.get('WSGI_PTVSD_SECRET')
+    if ptvsd_secret:
+        ptvsd_address = (env.get('WSGI_PTVSD_ADDRESS') or 'localhost:5678').split(':', 2)
+        try:
+            ptvsd_port = int(ptvsd_address[1])
+        except LookupError:
+            ptvsd_port = 5678
+        except ValueError:
+            log('"%s" is not a valid port number for debugging' % ptvsd_address[1])
+            ptvsd_port = 0
+
+        if ptvsd_address[0] and ptvsd_port:
+            try:
+                import ptvsd
+            except ImportError:
+                log('unable to import ptvsd to enable debugging')
+            else:
+                addr = ptvsd_address[0], ptvsd_port
+                ptvsd.enable_attach(secret=ptvsd_secret, address=addr)
+                log('debugging enabled on %s:%s' % addr)
+
+    response.error_message = ''
+    response.fatal_errors = False
+
+    log('wfastcgi.py %s initialized' % __version__)
+    return env, handler
+
+def run_request(stream, record):
+    """runs the WSGI handler for a complete request and sends its response"""
+    global _APPLICATION
+
+    errors = record.params['wsgi.errors'] = REQUEST_ERRORS.begin()
+    output = REQUEST_OUTPUT.begin()
+
+    with handle_response(stream, record, output.getvalue, errors.getvalue) as response:
+        if _APPLICATION is None:
+            _APPLICATION = initialize(response)
+        env, handler = _APPLICATION
+
+        os.environ.update(env)
+
+        # SCRIPT_NAME + PATH_INFO is supposed to be the full path
+        # (http://www.python.org/dev/peps/pep-0333/) but by default
+        # (http://msdn.microsoft.com/en-us/library/ms525840(v=vs.90).aspx)
+        # IIS is sending us the full URL in PATH_INFO, so we need to
+        # clear the script name here
+        if 'AllowPathInfoForScriptMappings' not in os.environ:
+            record.params['SCRIPT_NAME'] = ''
+            record.params['wsgi.script_name'] = wsgi_encode('')
+
+        # correct SCRIPT_NAME and PATH_INFO if we are told what our SCRIPT_NAME should be
+        if 'SCRIPT_NAME' in os.environ and record.params['PATH_INFO'].lower().startswith(os.environ['SCRIPT_NAME'].lower()):
+            record.params['SCRIPT_NAME'] = os.environ['SCRIPT_NAME']
+            record.params['PATH_INFO'] = record.params['PATH_INFO'][len(record.params['SCRIPT_NAME']):]
+            record.params['wsgi.script_name'] = wsgi_encode(record.params['SCRIPT_NAME'])
+            record.params['wsgi.path_info'] = wsgi_encode(record.params['PATH_INFO'])
+
+        # Send each part of the response to FCGI_STDOUT.
+        # Exceptions raised in the handler will be logged by the context
+        # manager and we will then wait for the next record.
+
+        result = handler(record.params, response.start)
+        try:
+            for part in result:
+                if part:
+                    response.send(FCGI_STDOUT, part)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
 def main():
-    initialized = False
     log('wfastcgi.py %s started' % __version__)
     log('Python version: %s' % sys.version)
 
@@ -769,89 +1133,23 @@ def main():
             msvcrt.setmode(fcgi_stream.fileno(), os.O_BINARY)
         except ImportError:
             pass
+        fcgi_stream = FastCgiStream(fcgi_stream)
 
+        sys.stdout = sys.__stdout__ = REQUEST_OUTPUT
+        sys.stderr = sys.__stderr__ = REQUEST_ERRORS
+
+        pool = RequestPool(MAX_REQUESTS) if MAX_REQUESTS > 1 else None
         while True:
             record = read_fastcgi_record(fcgi_stream)
             if not record:
                 continue
 
-            errors = sys.stderr = sys.__stderr__ = record.params['wsgi.errors'] = StringIO()
-            output = sys.stdout = sys.__stdout__ = StringIO()
-
-            with handle_response(fcgi_stream, record, output.getvalue, errors.getvalue) as response:
-                if not initialized:
-                    log('wfastcgi.py %s initializing' % __version__)
-
-                    os.chdir(response.physical_path)
-                    sys.path[0] = '.'
-
-                    # Initialization errors should be treated as fatal.
-                    response.fatal_errors = True
-                    response.error_message = 'Error occurred while reading WSGI handler'
-                    env, handler = read_wsgi_handler(response.physical_path)
-
-                    response.error_message = 'Error occurred starting file watcher'
-                    start_file_watcher(response.physical_path, env.get('WSGI_RESTART_FILE_REGEX'))
-
-                    # Enable debugging if possible. Default to local-only, but
-                    # allow a web.config to override where we listen
-                    ptvsd_secret = env.get('WSGI_PTVSD_SECRET')
-                    if ptvsd_secret:
-                        ptvsd_address = (env.get('WSGI_PTVSD_ADDRESS') or 'localhost:5678').split(':', 2)
-                        try:
-                            ptvsd_port = int(ptvsd_address[1])
-                        except LookupError:
-                            ptvsd_port = 5678
-                        except ValueError:
-                            log('"%s" is not a valid port number for debugging' % ptvsd_address[1])
-                            ptvsd_port = 0
-
-                        if ptvsd_address[0] and ptvsd_port:
-                            try:
-                                import ptvsd
-                            except ImportError:
-                                log('unable to import ptvsd to enable debugging')
-                            else:
-                                addr = ptvsd_address[0], ptvsd_port
-                                ptvsd.enable_attach(secret=ptvsd_secret, address=addr)
-                                log('debugging enabled on %s:%s' % addr)
-
-                    response.error_message = ''
-                    response.fatal_errors = False
-
-                    log('wfastcgi.py %s initialized' % __version__)
-                    initialized = True
-
-                os.environ.update(env)
-
-                # SCRIPT_NAME + PATH_INFO is supposed to be the full path
-                # (http://www.python.org/dev/peps/pep-0333/) but by default
-                # (http://msdn.microsoft.com/en-us/library/ms525840(v=vs.90).aspx)
-                # IIS is sending us the full URL in PATH_INFO, so we need to
-                # clear the script name here
-                if 'AllowPathInfoForScriptMappings' not in os.environ:
-                    record.params['SCRIPT_NAME'] = ''
-                    record.params['wsgi.script_name'] = wsgi_encode('')
-
-                # correct SCRIPT_NAME and PATH_INFO if we are told what our SCRIPT_NAME should be
-                if 'SCRIPT_NAME' in os.environ and record.params['PATH_INFO'].lower().startswith(os.environ['SCRIPT_NAME'].lower()):
-                    record.params['SCRIPT_NAME'] = os.environ['SCRIPT_NAME']
-                    record.params['PATH_INFO'] = record.params['PATH_INFO'][len(record.params['SCRIPT_NAME']):]
-                    record.params['wsgi.script_name'] = wsgi_encode(record.params['SCRIPT_NAME'])
-                    record.params['wsgi.path_info'] = wsgi_encode(record.params['PATH_INFO'])
-
-                # Send each part of the response to FCGI_STDOUT.
-                # Exceptions raised in the handler will be logged by the context
-                # manager and we will then wait for the next record.
-
-                result = handler(record.params, response.start)
-                try:
-                    for part in result:
-                        if part:
-                            response.send(FCGI_STDOUT, part)
-                finally:
-                    if hasattr(result, 'close'):
-                        result.close()
+            # The first request initializes the process before any other
+            # runs, and its errors are fatal
+            if pool and _APPLICATION is not None:
+                pool.submit(run_request, fcgi_stream, record)
+            else:
+                run_request(fcgi_stream, record)
     except _ExitException:
         pass
     except Exception:
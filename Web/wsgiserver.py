@@ -0,0 +1,35 @@
+"""
+This script runs the ClimateControl application on gunicorn, a production
+WSGI server with a pool of worker processes each serving requests from a pool
+of threads.  It is configured from the [web] section of ClimateControl.conf;
+send SIGHUP to reload that configuration and replace the workers gracefully.
+"""
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from lib.config import Config
+
+class WSGIServer(BaseApplication):
+    def load_config(self):
+        # Runs again on every SIGHUP so changes apply to the new workers
+        settings = Config().web
+
+        self.cfg.set('bind', os.environ.get('SERVER_BIND', settings['bind']))
+        self.cfg.set('worker_class', 'gthread')
+        self.cfg.set('workers', settings['workers'])
+        self.cfg.set('threads', settings['threads'])
+        self.cfg.set('keepalive', settings['keepalive'])
+        self.cfg.set('timeout', settings['timeout'])
+        self.cfg.set('graceful_timeout', settings['graceful_timeout'])
+
+    def load(self):
+        from ClimateControl import app
+
+        return app
+
+if __name__ == '__main__':
+    WSGIServer().run()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import sys
+
+from lib.analytics import ANALYTICS_QUERIES
+from lib.config import Config
+from lib.db import SQLite
+from lib.export import export, parse_bound, EXPORT_FORMATS
+from lib.log import log_init
+from lib.query import check_query_plans, RANGE_QUERIES
+
+log = logging.getLogger("ClimateControl")
+
+def open_database(config, args, readonly=False):
+    if args.path:
+        config.database['path'] = args.path
+
+    return SQLite.from_config(config, readonly=readonly)
+
+def migrate(config, args):
+    db = open_database(config, args)
+    try:
+        migrated = db.migrate_sensorout(args.chunk_size, drop=not args.keep)
+        log.info('Migration complete, {} sensorout rows converted'.format(migrated))
+
+        if migrated and args.vacuum:
+            log.info('Vacuuming {}'.format(db.path))
+            db.vacuum()
+    finally:
+        db.close()
+
+def check(config, args):
+    db = open_database(config, args)
+    try:
+        check_query_plans(db.cur, dict(RANGE_QUERIES, **ANALYTICS_QUERIES))
+        log.info('All range queries are served by index range scans')
+    finally:
+        db.close()
+
+def vacuum(config, args):
+    db = open_database(config, args)
+    try:
+        log.info('Vacuuming {} and enabling incremental vacuum'.format(db.path))
+        db.vacuum()
+    finally:
+        db.close()
+
+def export_readings(config, args):
+    db = open_database(config, args, readonly=True)
+    try:
+        chunks = export(db.cur, args.format, args.start, args.end, args.chunk_size)
+        if args.output == '-':
+            output = sys.stdout if args.format == 'csv' else sys.stdout.buffer
+        else:
+            output = open(args.output, 'w', newline='') if args.format == 'csv' else open(args.output, 'wb')
+
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output not in (sys.stdout, sys.stdout.buffer):
+                output.close()
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='ClimateControl database maintenance')
+    parser.add_argument('--path', help='database file (defaults to the configured path)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_migrate = commands.add_parser('migrate', help='convert a legacy sensorout table into readings')
+    parser_migrate.add_argument('--chunk-size', type=int, default=20000, help='sensorout rows per transaction')
+    parser_migrate.add_argument('--keep', action='store_true', help='keep the sensorout table after migrating')
+    parser_migrate.add_argument('--vacuum', action='store_true', help='vacuum the database after migrating')
+    parser_migrate.set_defaults(func=migrate)
+
+    parser_check = commands.add_parser('check', help='verify range queries do not fall back to full scans')
+    parser_check.set_defaults(func=check)
+
+    parser_vacuum = commands.add_parser('vacuum', help='rebuild the database file and enable incremental vacuum')
+    parser_vacuum.set_defaults(func=vacuum)
+
+    parser_export = commands.add_parser('export', help='stream a time range of readings to a file')
+    parser_export.add_argument('--start', type=parse_bound, default=0,
+                               help='epoch seconds or ISO 8601 UTC date (default everything)')
+    parser_export.add_argument('--end', type=parse_bound,
+                               help='epoch seconds or ISO 8601 UTC date, exclusive (default open ended)')
+    parser_export.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', help='output format')
+    parser_export.add_argument('--output', default='-', help='output file (default stdout)')
+    parser_export.add_argument('--chunk-size', type=int, default=5000, help='readings fetched at a time')
+    parser_export.set_defaults(func=export_readings)
+
+    args = parser.parse_args()
+
+    config = Config()
+    log_init('console', config.general['log_level'])
+
+    args.func(config, args)
+
+if __name__ == "__main__":
+    main()
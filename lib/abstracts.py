@@ -1,19 +1,48 @@
 import logging
 
-from lib.db import SQLite
+from lib.db import to_epoch_ms
+from lib.events import EventPublisher
+from lib.ingest import BatchWriter
+from lib.retention import Compactor
 
 log = logging.getLogger()
 
 class Sensor:
     def __init__(self, config):
         self._config = config
-        self.db = SQLite()
-        
-    def _update_sensor_database(self, date, var, value):
+        self.writer = None
+        self.compactor = None
+        self.events = None
+
+        if self._config.stream['enabled']:
+            self.events = EventPublisher(self._config.stream['socket_dir'])
+
         if not self._config.testing:
-            query = "INSERT INTO sensorout (date,var,value) VALUES (?,?,?);"
-            self.db.cur.execute(query, (date, var, float(value)))
-            self.db.con.commit()
+            # Retention passes share the writer's connection
+            self.compactor = Compactor(self._config)
+            self.writer = BatchWriter(self._config, self.compactor)
+            self.writer.start()
+        
+    def _update_sensor_database(self, timestamp, co2, tempC, tempF, humidity):
+        row = (to_epoch_ms(timestamp), float(co2), float(tempC), float(tempF), float(humidity))
+
+        if self.writer:
+            self.writer.put(row)
+
+        if self.events:
+            self.events.publish(
+                'reading', ts=row[0], co2=row[1], tempC=row[2], tempF=row[3], humidity=row[4]
+                )
         
     def _close(self):
-        self.db.close()
\ No newline at end of file
+        if self.events:
+            self.events.close()
+
+        if self.writer:
+            self.writer.close()
+            log.info('Sensor database writer committed {} rows in {} transactions ({} dropped)'.format(
+                self.writer.rows_written, self.writer.commits, self.writer.rows_dropped
+                ))
+            log.info('Retention compaction deleted {} rows and freed {} pages'.format(
+                self.compactor.rows_deleted, self.compactor.pages_freed
+                ))
\ No newline at end of file
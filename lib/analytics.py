@@ -0,0 +1,198 @@
+import logging
+import numpy as np
+import time
+
+from lib.db import READING_VARIABLES, ROLLUP_TIERS, to_epoch_ms
+
+log = logging.getLogger()
+
+# Seconds between SCD4x samples, used to estimate raw reading counts
+SAMPLE_PERIOD = 5
+
+# Most rows fetched for one request, the finest source within it is used
+ANALYTICS_MAX_ROWS = 20000
+
+DEFAULT_PERCENTILES = [5, 50, 95]
+
+OLDEST_QUERY = "SELECT min(ts) FROM {};"
+RAW_QUERY = "SELECT ts, {columns} FROM readings WHERE ts >= ? AND ts < ?;"
+ROLLUP_QUERY = "SELECT ts, {columns} FROM {table} WHERE ts >= ? AND ts < ?;"
+
+def _analytics_queries():
+    queries = {
+        'analytics_readings'    : RAW_QUERY.format(columns=', '.join(READING_VARIABLES.values())),
+        'oldest_readings'       : OLDEST_QUERY.format('readings')
+        }
+
+    for table, seconds in ROLLUP_TIERS:
+        columns = []
+        for column in READING_VARIABLES.values():
+            columns += ['{0}_min, {0}_max, {0}_sum, {0}_count'.format(column)]
+        queries['analytics_' + table] = ROLLUP_QUERY.format(columns=', '.join(columns), table=table)
+        queries['oldest_' + table] = OLDEST_QUERY.format(table)
+
+    return queries
+
+# Range queries by name, checked along with lib.query's by check_query_plans
+ANALYTICS_QUERIES = _analytics_queries()
+
+def profile_band(config, var):
+    """Returns the (low, high) control thresholds the active profile sets for
+    var, None for a bound it leaves empty, or None without any threshold"""
+    settings = getattr(config, var, dict())
+
+    band = []
+    for name in ['control_min_threshold', 'control_max_threshold']:
+        value = settings.get(name)
+        band.append(float(value) if value not in (None, '') else None)
+
+    return tuple(band) if band != [None, None] else None
+
+def analytics_source(cur, start, end, max_rows=ANALYTICS_MAX_ROWS):
+    """Returns the finest table that holds every stored reading from start to
+    end (epoch ms) in at most max_rows rows, falling back to the coarsest
+    tier"""
+    sources = [('readings', SAMPLE_PERIOD)] + ROLLUP_TIERS
+    oldest = {table: cur.execute(ANALYTICS_QUERIES['oldest_' + table]).fetchone()[0] for table, _ in sources}
+    if all(ts is None for ts in oldest.values()):
+        return sources[-1][0]
+
+    # Nothing is stored before the oldest row of any table, so a range that
+    # starts earlier only needs a table reaching back to that row.  Rollup
+    # buckets start on their boundaries, which makes the coarsest tier's
+    # oldest bucket the earliest bound the tables can be compared on.
+    bucket = sources[-1][1] * 1000
+    earliest = min(ts for ts in oldest.values() if ts is not None)
+    for table, seconds in sources[:-1]:
+        if (end - max(start, earliest)) / 1000 / seconds > max_rows:
+            continue
+
+        # Raw readings and short lived tiers may already be compacted away
+        if oldest[table] is None:
+            continue
+
+        if oldest[table] <= start or (start <= earliest and oldest[table] // bucket <= earliest // bucket):
+            return table
+
+    return sources[-1][0]
+
+def _fetch(cur, table, start, end):
+    """Returns bucket timestamps and per variable (values, weights, mins, maxs)
+    arrays.  Raw readings weigh one sample each, rollup buckets their mean
+    weighted by the samples they hold."""
+    if table == 'readings':
+        width = 1 + len(READING_VARIABLES)
+    else:
+        width = 1 + 4 * len(READING_VARIABLES)
+
+    rows = cur.execute(ANALYTICS_QUERIES['analytics_' + table], (start, end)).fetchall()
+    rows = np.array(rows, dtype=np.float64).reshape(-1, width)
+
+    series = dict()
+    for idx, var in enumerate(READING_VARIABLES):
+        if table == 'readings':
+            values = rows[:, 1 + idx]
+            weights = (~np.isnan(values)).astype(np.float64)
+            series[var] = (values, weights, values, values)
+        else:
+            low, high, total, count = rows[:, 1 + idx * 4:5 + idx * 4].T
+            count = np.nan_to_num(count)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                series[var] = (total / count, count, low, high)
+
+    return rows[:, 0], series
+
+def local_hours(ts):
+    """Returns the local hour of each epoch ms timestamp, using the UTC offset
+    in effect at that time so ranges spanning a DST change stay aligned"""
+    # Offsets only change on quarter hours, so each quarter is looked up once
+    quarters = np.floor_divide(ts, 900000).astype(np.int64)
+    unique, inverse = np.unique(quarters, return_inverse=True)
+    local = np.array([time.localtime(quarter * 900).tm_hour for quarter in unique.tolist()], dtype=np.int64)
+
+    return local[inverse.reshape(-1)]
+
+def local_hour_mask(ts, hours):
+    """Returns a mask of the epoch ms timestamps whose local hour falls within
+    hours (start, end), wrapping past midnight when end < start"""
+    start, end = hours
+    hour = local_hours(ts)
+    if start <= end:
+        return (hour >= start) & (hour < end)
+
+    return (hour >= start) | (hour < end)
+
+def weighted_percentiles(values, weights, percentiles):
+    """Returns the weighted percentiles of values, which must not hold NaN"""
+    order = np.argsort(values)
+    values = values[order]
+    cumulative = np.cumsum(weights[order])
+
+    targets = np.asarray(percentiles, dtype=np.float64) / 100 * cumulative[-1]
+    indices = np.searchsorted(cumulative, targets, side='left')
+
+    return values[np.minimum(indices, len(values) - 1)]
+
+def variable_stats(values, weights, mins, maxs, percentiles, band=None):
+    """Returns summary statistics and, given a (low, high) band, the fraction
+    of samples below, inside and above it"""
+    valid = (weights > 0) & ~np.isnan(values)
+    values, weights, mins, maxs = values[valid], weights[valid], mins[valid], maxs[valid]
+
+    samples = int(weights.sum())
+    if not samples:
+        return {'samples': 0}
+
+    stats = {
+        'samples'       : samples,
+        'min'           : float(np.nanmin(mins)),
+        'max'           : float(np.nanmax(maxs)),
+        'mean'          : float(np.dot(values, weights) / weights.sum()),
+        'percentiles'   : dict(zip(
+            ['{:g}'.format(p) for p in percentiles],
+            weighted_percentiles(values, weights, percentiles).tolist()
+            ))
+        }
+
+    if band:
+        low = band[0] if band[0] is not None else -np.inf
+        high = band[1] if band[1] is not None else np.inf
+        below = weights[values < low].sum() / weights.sum()
+        above = weights[values > high].sum() / weights.sum()
+        stats['band'] = {
+            'low'       : band[0],
+            'high'      : band[1],
+            'below'     : float(below),
+            'inside'    : float(1 - below - above),
+            'above'     : float(above)
+            }
+
+    return stats
+
+def range_stats(cur, start, end=None, variables=None, percentiles=DEFAULT_PERCENTILES, bands=None,
+                hours=None, max_rows=ANALYTICS_MAX_ROWS):
+    """Computes statistics per variable for readings between start and end
+    (epoch seconds or naive UTC datetimes, end exclusive and open ended when
+    None).  Long ranges are answered from rollups, where percentiles and band
+    fractions are taken over per bucket means and so are approximate.
+    @param bands: dict of variable to (low, high) thresholds.
+    @param hours: (start, end) local hours to restrict the range to.
+    """
+    start = to_epoch_ms(start)
+    end = to_epoch_ms(end) if end is not None else int(time.time() * 1000)
+
+    table = analytics_source(cur, start, end, max_rows)
+    ts, series = _fetch(cur, table, start, end)
+    mask = local_hour_mask(ts, hours) if hours else slice(None)
+
+    results = dict()
+    for var in variables or READING_VARIABLES:
+        values, weights, mins, maxs = [array[mask] for array in series[var]]
+        results[var] = variable_stats(values, weights, mins, maxs, percentiles, (bands or dict()).get(var))
+
+    return {
+        'start'     : start,
+        'end'       : end,
+        'source'    : table,
+        'variables' : results
+        }
@@ -1,6 +1,8 @@
 import configparser
 import os
 
+from threading import Lock
+
 from lib.common import is_str_bool, is_str_int
 
 APP_ROOT = os.path.abspath(
@@ -12,6 +14,8 @@ APP_ROOT = os.path.abspath(
 class Config:
     def __init__(self, testing=False):
         self.testing = testing
+        self._paths = []
+        self.mtimes = []
         
         config_path = os.path.join(
             APP_ROOT, 'conf', 'ClimateControl.conf'
@@ -28,6 +32,10 @@ class Config:
         self._process_config(env_config_path)
         
     def _process_config(self, config_path):
+        # Taken before reading, a change made while reading reloads it again
+        self._paths.append(config_path)
+        self.mtimes.append(file_mtime(config_path))
+
         try:
             config = configparser.ConfigParser(allow_no_value=True, interpolation=None)
             config.read(config_path)  
@@ -54,4 +62,25 @@ class Config:
                 else:
                     value = config.get(section, name)
 
-                getattr(self, section)[name] = value
\ No newline at end of file
+                getattr(self, section)[name] = value
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+class ConfigCache:
+    """Process-wide Config that is only parsed again when one of the files it
+    was read from has been modified."""
+    def __init__(self, testing=False):
+        self.testing = testing
+        self._config = None
+        self._lock = Lock()
+
+    def get(self):
+        with self._lock:
+            if self._config is None or [file_mtime(path) for path in self._config._paths] != self._config.mtimes:
+                self._config = Config(self.testing)
+
+            return self._config
\ No newline at end of file
@@ -2,7 +2,8 @@ import logging
 import time
 
 from enum import Enum
-from threading import Thread
+
+from lib.variables import VARIABLES
 
 log = logging.getLogger(__name__)
 
@@ -42,7 +43,6 @@ class Controller:
         self.control_max_channel        = None
         self.control_max_device         = None
         self.control_max_threshold      = 0.0
-        self.control_thread             = Thread()
 
         # Schedule control
         self.control_on_hr              = False
@@ -54,6 +54,14 @@ class Controller:
         self.chart_range_max            = 0
         self.chart_color                = None
 
+    def _describe(self, variable):
+        self.name                       = variable.name
+        self.description                = variable.description
+        self.chart_unit                 = variable.chart_unit
+        self.chart_range_min            = variable.chart_range_min
+        self.chart_range_max            = variable.chart_range_max
+        self.chart_color                = variable.chart_color
+
     def _initialize(self):
         if isinstance(self.control_offset, int) and self.control_frequency < self.control_offset:
             raise Exception("The control offset {} for {} exceeds the total frequency of {}".format(self.control_offset, self.name, self.control_frequency))
@@ -67,6 +75,57 @@ class Controller:
 
         return False
 
+    def wants_sample(self):
+        """Returns whether control has to run on every new sensor sample"""
+        return self.control_enabled and self.control_method == 'threshold'
+
+    def next_deadline(self, now):
+        """Returns the epoch time control next has to run without a new
+        sample, or None when nothing but a new sample can change its relays"""
+        if not self.control_enabled:
+            return None
+
+        if self.control_method == 'frequency':
+            return self._frequency_deadline(now)
+
+        elif self.control_method == 'schedule':
+            return self._schedule_deadline(now)
+
+        return None
+
+    def _frequency_deadline(self, now):
+        if not self.control_device:
+            return None
+
+        if isinstance(self.control_offset, int) and not self.frequency_started:
+            return self.frequency_time + self.control_offset
+
+        if not self.frequency_time:
+            return now
+
+        return self.frequency_time + self.control_frequency
+
+    def _schedule_deadline(self, now):
+        if not self.control_device:
+            return None
+
+        current_hour = time.localtime(now).tm_hour
+        scheduled_on = current_hour >= self.control_on_hr and current_hour < self.control_off_hr
+        if scheduled_on != (self.status == RelayState.On):
+            return now
+
+        # The next top of the hour that opens or closes the schedule, found
+        # through mktime so DST changes and part hour offsets are respected
+        local = time.localtime(now)
+        for hours in range(1, 26):
+            deadline = time.mktime((
+                local.tm_year, local.tm_mon, local.tm_mday, local.tm_hour + hours, 0, 0, 0, 0, -1
+                ))
+            if time.localtime(deadline).tm_hour in (self.control_on_hr, self.control_off_hr):
+                return deadline
+
+        return None
+
     def _control(self, current_time, control_val=None):
         if not self.control_enabled:
             return
@@ -84,9 +143,22 @@ class Controller:
         elif self.control_method == 'schedule':
             self._control_schedule(current_time)
 
+    def _actuate(self, channel, device):
+        # Marked on first, as a short duration may end before the call returns
+        self.status = RelayState.On
+        try:
+            self.relay.turn_on_channel(channel, device, self.control_duration, self._actuation_ended)
+        except:
+            self.status = RelayState.Off
+            raise
+
+    def _actuation_ended(self, channel, device):
+        # Called from the relay's timer thread once the channel is off again
+        self.status = RelayState.Off
+
     def _control_theshold(self, control_val):
         if control_val <= float(self.control_min_threshold):
-            if self._controllable(RelayState.Off, self.control_min_device) and not self.control_thread.is_alive():
+            if self._controllable(RelayState.Off, self.control_min_device):
                 log.warning(
                     '%s (%f%s) has dropped below the threshhold of %f%s' % (
                         self.name.title(),
@@ -97,13 +169,10 @@ class Controller:
                         )
                     )
 
-                self.control_thread = self.relay.turn_on_channel(
-                    self.control_min_channel, self.control_min_device, True, self.control_duration
-                    )
-                self.status = RelayState.On
+                self._actuate(self.control_min_channel, self.control_min_device)
 
         elif control_val >= float(self.control_max_threshold):
-            if self._controllable(RelayState.Off, self.control_max_device) and not self.control_thread.is_alive():
+            if self._controllable(RelayState.Off, self.control_max_device):
                 log.warning(
                     '%s (%f%s) has raised above the threshhold of %f%s' % (
                         self.name.title(),
@@ -114,22 +183,7 @@ class Controller:
                         )
                     )
 
-                self.control_thread = self.relay.turn_on_channel(
-                    self.control_max_channel, self.control_max_device, True, self.control_duration
-                    )
-                self.status = RelayState.On
-
-        if self._controllable(RelayState.On, self.control_min_device) and not self.control_thread.is_alive():
-            self.relay.turn_off_channel(
-                self.control_min_channel, self.control_min_device
-                )
-            self.status = RelayState.Off
-
-        elif self._controllable(RelayState.On, self.control_max_device) and not self.control_thread.is_alive():
-            self.relay.turn_off_channel(
-                self.control_max_channel, self.control_max_device
-                )
-            self.status = RelayState.Off
+                self._actuate(self.control_max_channel, self.control_max_device)
 
     def _control_frequency(self, current_time):
         if isinstance(self.control_offset, int) and not self.frequency_started and ((time.time() - self.frequency_time) > self.control_offset):
@@ -137,20 +191,10 @@ class Controller:
             self.frequency_time = None
 
         if not self.frequency_time or (time.time() - self.frequency_time) > self.control_frequency:
-            if self._controllable(RelayState.Off, self.control_device) and not self.control_thread.is_alive():
-                self.control_thread = self.relay.turn_on_channel(
-                    self.control_channel, self.control_device, 
-                    threaded=True, thread_sleep=self.control_duration
-                    )
-                self.status = RelayState.On
+            if self._controllable(RelayState.Off, self.control_device):
+                self._actuate(self.control_channel, self.control_device)
                 self.frequency_time = time.time()
 
-        elif self._controllable(RelayState.On, self.control_device) and not self.control_thread.is_alive():
-            self.relay.turn_off_channel(
-                self.control_channel, self.control_device
-                )
-            self.status = RelayState.Off
-
     def _control_schedule(self, current_time):
         current_hour = current_time.tm_hour
         if current_hour >= self.control_on_hr and current_hour < self.control_off_hr:
@@ -178,12 +222,7 @@ class CO2(Controller):
     def __init__(self, sensor, relay):
         super().__init__(sensor, relay)
 
-        self.name               = 'co2'
-        self.description        = 'CO2'
-        self.chart_unit         = 'ppm'
-        self.chart_range_min    = 0
-        self.chart_range_max    = 4000
-        self.chart_color        = 'cyan'
+        self._describe(VARIABLES['CO2'])
 
     def update_sensor_output(self):
         self.value = self.sensor.get_variable('co2')
@@ -200,12 +239,7 @@ class Humidity(Controller):
     def __init__(self, sensor, relay):
         super().__init__(sensor, relay)
 
-        self.name               = 'humidity'
-        self.description        = 'Humidity'
-        self.chart_unit         = '% RH'
-        self.chart_range_min    = 35
-        self.chart_range_max    = 100
-        self.chart_color        = 'orangered'
+        self._describe(VARIABLES['Humidity'])
 
     def update_sensor_output(self):
         self.value = self.sensor.get_variable('humidity')
@@ -222,12 +256,7 @@ class TemperatureFarenheit(Controller):
     def __init__(self, sensor, relay):
         super().__init__(sensor, relay)
 
-        self.name               = 'tempF'
-        self.description        = 'Temp Farenheit'
-        self.chart_unit         = '&deg;'
-        self.chart_range_min    = 50
-        self.chart_range_max    = 100
-        self.chart_color        = 'lawngreen'
+        self._describe(VARIABLES['TemperatureFarenheit'])
 
     def update_sensor_output(self):
         self.value = self.sensor.get_variable('tempF')
@@ -244,12 +273,7 @@ class TemperatureCelsius(Controller):
     def __init__(self, sensor, relay):
         super().__init__(sensor, relay)
 
-        self.name               = 'tempC'
-        self.description        = 'Temp Celsius'
-        self.chart_unit         = '&deg;'
-        self.chart_range_min    = 15
-        self.chart_range_max    = 40
-        self.chart_color        = 'fuchsia'
+        self._describe(VARIABLES['TemperatureCelsius'])
 
     def update_sensor_output(self):
         self.value = self.sensor.get_variable('tempC')
@@ -266,8 +290,7 @@ class Light(Controller):
     def __init__(self, sensor, relay):
         super().__init__(sensor, relay)
 
-        self.name               = 'light'
-        self.description        = 'Light'
+        self._describe(VARIABLES['Light'])
 
     def update_sensor_output(self):
         pass
@@ -2,39 +2,263 @@ import certifi
 import logging
 import sqlite3
 
+from datetime import datetime, timezone
+from queue import LifoQueue, Empty
+from threading import BoundedSemaphore
+from urllib.request import pathname2url
+
 log = logging.getLogger()
+
+# Controller name (also the legacy sensorout var) to readings column
+READING_VARIABLES = {
+    'CO2'                   : 'co2',
+    'TemperatureCelsius'    : 'tempC',
+    'TemperatureFarenheit'  : 'tempF',
+    'Humidity'              : 'humidity'
+}
+
+READING_COLUMNS = ['ts'] + list(READING_VARIABLES.values())
+
+# Upper bound for open ended time ranges
+MAX_TS = 2 ** 63 - 1
+
+# Rollup tables and their bucket size in seconds, finest first.  Each bucket
+# keeps min/max/sum/count per variable so coarser tiers can be built from
+# finer ones and averages stay exact.
+ROLLUP_TIERS = [
+    ('rollup_1m',   60),
+    ('rollup_15m',  900),
+    ('rollup_1h',   3600)
+]
+
+ROLLUP_AGGREGATES = ['min', 'max', 'sum', 'count']
+
+def to_epoch_ms(value):
+    """Convert a naive UTC datetime, a legacy sensorout date string or epoch
+    seconds to integer epoch milliseconds.
+    @param value: datetime, str or float to be converted.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+
+    if isinstance(value, datetime):
+        value = value.replace(tzinfo=timezone.utc).timestamp()
+
+    return int(round(value * 1000))
         
 class SQLite():
-    def __init__(self):
-        self.con = sqlite3.connect('ClimateControlDB')
+    def __init__(self, path='ClimateControlDB', without_rowid=False, readonly=False,
+                 journal_mode=None, synchronous=None, wal_autocheckpoint=None, busy_timeout=100,
+                 check_same_thread=True):
+        self.path = path
+        self.without_rowid = without_rowid
+        self.readonly = readonly
+
+        if readonly:
+            # Readers never take the write lock and never touch the schema
+            self.con = sqlite3.connect(
+                'file:{}?mode=ro'.format(pathname2url(path)), uri=True, check_same_thread=check_same_thread
+                )
+        else:
+            self.con = sqlite3.connect(path, check_same_thread=check_same_thread)
         self.cur = self.con.cursor()
-        
-        self._initialize()
+
+        self.cur.execute("PRAGMA busy_timeout = {};".format(int(busy_timeout)))
+
+        if not readonly:
+            self._initialize()
+
+            if journal_mode:
+                mode = self.cur.execute("PRAGMA journal_mode = {};".format(journal_mode)).fetchone()[0]
+                if mode.lower() != journal_mode.lower():
+                    log.warning('Unable to set journal mode {} on {}, using {}'.format(journal_mode, path, mode))
+
+            if synchronous:
+                self.cur.execute("PRAGMA synchronous = {};".format(synchronous))
+
+            if wal_autocheckpoint:
+                self.cur.execute("PRAGMA wal_autocheckpoint = {};".format(int(wal_autocheckpoint)))
+
+    @classmethod
+    def from_config(cls, config, readonly=False, check_same_thread=True):
+        """Opens the database described by the [database] config section,
+        either as a writer or as a read-only connection for the web server."""
+        settings = config.database
+        return cls(
+            settings['path'],
+            without_rowid=settings['without_rowid'],
+            readonly=readonly,
+            journal_mode=settings['journal_mode'],
+            synchronous=settings['synchronous'],
+            wal_autocheckpoint=settings['wal_autocheckpoint'],
+            busy_timeout=settings['busy_timeout'],
+            check_same_thread=check_same_thread
+            )
         
     def _initialize(self):
         table_schema = {
-            'sensorout': {
-                'date'  : 'DATE',
-                'var'   : 'TEXT',
-                'value' : 'FLOAT'
+            'readings': {
+                'ts'        : 'INTEGER PRIMARY KEY',
+                'co2'       : 'REAL',
+                'tempC'     : 'REAL',
+                'tempF'     : 'REAL',
+                'humidity'  : 'REAL'
             }
         }
+
+        for table, seconds in ROLLUP_TIERS:
+            table_schema[table] = {'ts': 'INTEGER PRIMARY KEY'}
+            for column in READING_VARIABLES.values():
+                for aggregate in ROLLUP_AGGREGATES:
+                    dtype = 'INTEGER' if aggregate == 'count' else 'REAL'
+                    table_schema[table]['{}_{}'.format(column, aggregate)] = dtype
         
         result = self.cur.execute("SELECT * FROM sqlite_master WHERE type='table'")
         tables = result.fetchall()
+
+        # auto_vacuum can only be switched on before the first table exists,
+        # existing databases need a full vacuum to pick it up
+        if not tables:
+            self.cur.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+
         for table, cols in table_schema.items():
             if not any(item[1] == table for item in tables):
                 query_params = []
                 for col, dtype in cols.items():
                     query_params.append('{} {}'.format(col, dtype))
-                query_string = "CREATE TABLE {}({})".format(table, ', '.join(query_params))
+                query_string = "CREATE TABLE IF NOT EXISTS {}({})".format(table, ', '.join(query_params))
+                if self.without_rowid:
+                    query_string += " WITHOUT ROWID"
                 
                 log.info('Executing query string {}'.format(query_string))
                 self.cur.execute(query_string)
 
-        self.cur.execute("PRAGMA busy_timeout = 100;")
+        if any(item[1] == 'sensorout' for item in tables):
+            log.warning('Legacy sensorout table found in {}, run "dbtool.py migrate" to convert it'.format(self.path))
+
+    def insert_many(self, rows):
+        """Inserts readings rows.  The caller owns the transaction."""
+        query = "INSERT OR REPLACE INTO readings ({}) VALUES ({});".format(
+            ','.join(READING_COLUMNS), ','.join('?' * len(READING_COLUMNS))
+            )
+        self.cur.executemany(query, rows)
+
+    def migrate_sensorout(self, chunk_size=20000, drop=True):
+        """Convert the legacy narrow sensorout table into readings.  Rows are
+        copied in rowid order, one transaction per chunk, so an interrupted
+        migration can simply be run again."""
+        result = self.cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sensorout'")
+        if not result.fetchone():
+            log.info('No sensorout table to migrate in {}'.format(self.path))
+            return 0
+
+        columns = list(READING_VARIABLES.values())
+        query = "INSERT INTO readings ({}) VALUES ({}) ON CONFLICT(ts) DO UPDATE SET {};".format(
+            ','.join(READING_COLUMNS),
+            ','.join('?' * len(READING_COLUMNS)),
+            ', '.join('{0} = coalesce(excluded.{0}, {0})'.format(col) for col in columns)
+            )
+
+        migrated = 0
+        last_rowid = 0
+        while True:
+            rows = self.cur.execute(
+                "SELECT rowid, date, var, value FROM sensorout WHERE rowid > ? ORDER BY rowid LIMIT ?;",
+                (last_rowid, chunk_size)
+                ).fetchall()
+            if not rows:
+                break
+
+            samples = dict()
+            for rowid, date, var, value in rows:
+                column = READING_VARIABLES.get(var)
+                if column is None:
+                    log.warning('Skipping sensorout row {} with unknown variable {}'.format(rowid, var))
+                    continue
+
+                ts = to_epoch_ms(date)
+                if ts not in samples:
+                    samples[ts] = dict.fromkeys(columns)
+                samples[ts][column] = value
+
+            self.cur.executemany(
+                query, [[ts] + [sample[col] for col in columns] for ts, sample in samples.items()]
+                )
+            self.con.commit()
+
+            last_rowid = rows[-1][0]
+            migrated += len(rows)
+            log.info('Migrated {} sensorout rows into readings'.format(migrated))
+
+        if drop:
+            self.cur.execute("DROP TABLE sensorout;")
+            self.con.commit()
+
+        return migrated
+
+    def checkpoint(self, mode='PASSIVE'):
+        """Copies the write-ahead log back into the database file"""
+        return self.cur.execute("PRAGMA wal_checkpoint({});".format(mode)).fetchone()
+
+    def vacuum(self):
+        self.cur.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        self.cur.execute("VACUUM;")
+        
+    def reset(self):
+        """Finalizes any unfinished statement so the connection holds no read
+        snapshot while it is idle"""
+        self.cur.close()
+        if self.con.in_transaction:
+            self.con.rollback()
+        self.cur = self.con.cursor()
         
     def close(self):
         self.cur.close()
         self.con.close()
 
+class SQLitePool():
+    """Bounded pool of connections made by factory.  checkout blocks for up to
+    timeout seconds when every connection is in use."""
+    def __init__(self, factory, size=4, timeout=10):
+        self.timeout = timeout
+        self.closed = False
+
+        self._factory = factory
+        self._idle = LifoQueue()
+        self._slots = BoundedSemaphore(size)
+
+    def checkout(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise Exception("Timed out waiting {}s for a database connection".format(self.timeout))
+
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        try:
+            return self._factory()
+        except:
+            self._slots.release()
+            raise
+
+    def checkin(self, sqlite):
+        try:
+            if self.closed:
+                sqlite.close()
+            else:
+                sqlite.reset()
+                self._idle.put(sqlite)
+        except sqlite3.Error:
+            log.exception('Discarding broken pooled connection to {}'.format(sqlite.path))
+            sqlite.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
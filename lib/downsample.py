@@ -0,0 +1,53 @@
+import numpy as np
+
+def lttb_indices(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling.  Returns the indices of at
+    most threshold points of (x, y) that best preserve the visual shape of the
+    series, always keeping the first and last point and any spikes.
+    @param x: 1-D array of increasing x values.
+    @param y: 1-D array of y values, without NaNs.
+    @param threshold: number of points to keep.
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Interior points split into threshold - 2 buckets, the first and last
+    # points are their own buckets
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = length - 1
+
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        # Average of the next bucket is the third point of the triangle
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x = x[-1]
+            avg_y = y[-1]
+
+        areas = np.abs(
+            (x[selected] - avg_x) * (y[start:end] - y[selected]) -
+            (x[selected] - x[start:end]) * (avg_y - y[selected])
+            )
+
+        selected = start + int(areas.argmax())
+        indices[bucket + 1] = selected
+
+    return indices
+
+def lttb(x, y, threshold):
+    """Returns the downsampled x and y arrays of a series"""
+    indices = lttb_indices(x, y, threshold)
+
+    return np.asarray(x)[indices], np.asarray(y)[indices]
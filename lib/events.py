@@ -0,0 +1,38 @@
+import errno
+import glob
+import json
+import logging
+import os
+import socket
+
+log = logging.getLogger()
+
+class EventPublisher(object):
+    """Fire-and-forget publisher of live events to every subscriber socket in
+    a directory.  Each web server process binds one unix datagram socket
+    there; publishing never blocks and sockets left behind by dead
+    subscribers are removed."""
+    def __init__(self, socket_dir):
+        self.socket_dir = socket_dir
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def publish(self, event_type, **fields):
+        fields['type'] = event_type
+        payload = json.dumps(fields).encode('utf-8')
+
+        for path in glob.glob(os.path.join(self.socket_dir, '*.sock')):
+            try:
+                self.sock.sendto(payload, path)
+            except OSError as e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    log.debug('Removing stale event subscriber {}'.format(path))
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                elif e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    log.debug('Failed to publish event to {}: {}'.format(path, e))
+
+    def close(self):
+        self.sock.close()
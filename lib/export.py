@@ -0,0 +1,142 @@
+import csv
+import io
+import logging
+import numpy as np
+import zipfile
+
+from datetime import datetime, timezone
+
+from lib.db import READING_COLUMNS, MAX_TS, to_epoch_ms
+from lib.query import count_range, select_range
+
+log = logging.getLogger()
+
+# Readings fetched from the cursor at a time, which bounds export memory
+EXPORT_CHUNK = 5000
+
+# Export format to mimetype and file extension
+EXPORT_FORMATS = {
+    'csv'   : ('text/csv', 'csv'),
+    'npz'   : ('application/octet-stream', 'npz')
+}
+
+# One record per reading in npz exports, load with np.load(path)['readings']
+EXPORT_DTYPE = np.dtype([('ts', '<i8')] + [(column, '<f8') for column in READING_COLUMNS[1:]])
+
+def parse_bound(value):
+    """Returns a range bound given as epoch seconds or an ISO 8601 date
+    string, UTC unless it carries an offset, in the form select_range
+    accepts.  Raises ValueError for anything else, so requests can be
+    rejected before a response starts."""
+    if value is None:
+        return None
+
+    try:
+        bound = float(value)
+    except ValueError:
+        bound = datetime.fromisoformat(value)
+        if bound.tzinfo is not None:
+            bound = bound.astimezone(timezone.utc).replace(tzinfo=None)
+
+    try:
+        ts = to_epoch_ms(bound)
+    except OverflowError:
+        raise ValueError("Range bound {} is out of range".format(value))
+
+    if not -MAX_TS <= ts <= MAX_TS:
+        raise ValueError("Range bound {} is out of range".format(value))
+
+    return bound
+
+def _chunks(cur, start, end, chunk_size):
+    # Rows are pulled from a single statement chunk_size at a time.  The
+    # snapshot it reads from never blocks the daemon's inserts in WAL mode.
+    results = select_range(cur, start, end)
+    while True:
+        rows = results.fetchmany(chunk_size)
+        if not rows:
+            break
+
+        yield rows
+
+def export_csv(cur, start, end=None, chunk_size=EXPORT_CHUNK):
+    """Yields readings between start and end as CSV text, ts in epoch
+    milliseconds and missing values left empty."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(READING_COLUMNS)
+    for rows in _chunks(cur, start, end, chunk_size):
+        writer.writerows(rows)
+
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+class _ZipStream(io.RawIOBase):
+    """Unseekable sink that lets ZipFile be drained while it is written"""
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_npz(cur, start, end=None, chunk_size=EXPORT_CHUNK):
+    """Yields readings between start and end as a compressed npz archive
+    holding a single EXPORT_DTYPE record array, missing values as NaN."""
+    # The .npy header needs the row count, so count and rows are read in one
+    # transaction to see the same snapshot
+    cur.execute('BEGIN')
+    try:
+        count = count_range(cur, start, end)
+
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open('readings.npy', mode='w', force_zip64=True) as member:
+                np.lib.format.write_array_header_1_0(member, {
+                    'descr'         : np.lib.format.dtype_to_descr(EXPORT_DTYPE),
+                    'fortran_order' : False,
+                    'shape'         : (count,)
+                    })
+
+                written = 0
+                for rows in _chunks(cur, start, end, chunk_size):
+                    # None becomes NaN going through a plain float array
+                    values = np.array(rows, dtype=np.float64)
+                    records = np.empty(len(rows), dtype=EXPORT_DTYPE)
+                    records['ts'] = values[:, 0].astype(np.int64)
+                    for idx, column in enumerate(READING_COLUMNS[1:], 1):
+                        records[column] = values[:, idx]
+
+                    member.write(records.tobytes())
+                    written += len(rows)
+
+                    yield stream.drain()
+
+                if written != count:
+                    raise Exception("Exported {} readings, expected {}".format(written, count))
+
+        yield stream.drain()
+    finally:
+        cur.connection.rollback()
+
+def export(cur, fmt, start, end=None, chunk_size=EXPORT_CHUNK):
+    """Returns a generator of fmt encoded chunks of the readings between start
+    and end (exclusive, open ended when None)."""
+    if fmt == 'csv':
+        return export_csv(cur, start, end, chunk_size)
+    elif fmt == 'npz':
+        return export_npz(cur, start, end, chunk_size)
+
+    raise Exception("Unknown export format {}, expected one of {}".format(fmt, ', '.join(EXPORT_FORMATS)))
@@ -3,18 +3,23 @@ import math
 import smbus
 import time
 
-from datetime import datetime
 from grove_rgb_lcd import setRGB, setText
 from grovepi import dht, analogRead
 from sensirion_i2c_driver import LinuxI2cTransceiver, I2cConnection
 from sensirion_i2c_scd import Scd4xI2cDevice
-from threading import Thread
 
 from lib.abstracts import Sensor
 from lib.common import celsiusToFarenheit
 from lib.controllers import RelayState
+from lib.events import EventPublisher
+from lib.relay import RelayRegister
+from lib.sampling import SampleScheduler
+from lib.timers import TimerScheduler
 
 log = logging.getLogger()
+
+# Seconds between logged failures while the scd4x keeps failing to read
+READ_ERROR_LOG_INTERVAL = 60
         
 # https://sensirion.github.io/python-i2c-scd/
 class SensirionMonitor(Sensor):
@@ -28,10 +33,16 @@ class SensirionMonitor(Sensor):
         
         self.serial = None
         
+        self._read_errors = 0
+        self._suppressed_errors = 0
+        self._next_error_log = 0.0
         
         i2c_port = self._config.general['scd4x_sensor_path']
         altitude = self._config.general['scd4x_sensor_altitude']
         
+        # Measurements are read once they are due rather than polled for
+        self.sampler = SampleScheduler(self._config.general['scd4x_sample_period'])
+        
         self.i2c_transceiver = LinuxI2cTransceiver(i2c_port)
         
         # Create SCD4x device
@@ -96,44 +107,81 @@ class SensirionMonitor(Sensor):
         var = getattr(self, name)
         return round(var, 2)
         
-    def read_scd4x(self, farenheit=True):
+    def _read_measurement(self):
         # Ensure status is ready to read, then read variables
+        if not self.scd4x.get_data_ready_status():
+            return False
+        
+        co2, temp, humidity = self.scd4x.read_measurement()
+    
+        self.co2 = co2.co2
+        self.tempC = temp.degrees_celsius
+        self.tempF = temp.degrees_fahrenheit
+        self.humidity = humidity.percent_rh
+    
+        self._update_sensor_database(
+            time.time(), self.co2, self.tempC, self.tempF, self.humidity
+            )
+    
+        return True
+        
+    def read_scd4x(self, farenheit=True):
         try:
-            if self.scd4x.get_data_ready_status():
-                co2, temp, humidity = self.scd4x.read_measurement()
-            
-                self.co2 = co2.co2
-                self.tempC = temp.degrees_celsius
-                self.tempF = temp.degrees_fahrenheit
-                self.humidity = humidity.percent_rh
-            
-                current_date = datetime.utcnow()
-                self._update_sensor_database(current_date, 'CO2', self.co2)
-                self._update_sensor_database(current_date, 'TemperatureFarenheit', self.tempF)
-                self._update_sensor_database(current_date, 'TemperatureCelsius', self.tempC)
-                self._update_sensor_database(current_date, 'Humidity', self.humidity)
-            
-                return True
-            
+            return self._read_measurement()
         except Exception as e:
             log.exception('Failed to read sensor: {}'.format(e))
                 
             return False
+    
+    def _read_failed(self, e):
+        # A failing bus is logged at most once per interval rather than on
+        # every retry
+        self._read_errors += 1
+        now = time.monotonic()
+        if now < self._next_error_log:
+            self._suppressed_errors += 1
+            return
         
-        return False
+        log.exception('Failed to read sensor, {} failures in a row, {} not logged since the last: {}'.format(
+            self._read_errors, self._suppressed_errors, e
+            ))
+        self._suppressed_errors = 0
+        self._next_error_log = now + READ_ERROR_LOG_INTERVAL
     
     def read_wait_scd4x(self, max_wait=60):
-        attempt = 0
-        while not self.read_scd4x():
-            attempt += 1
-            time.sleep(1)
+        # Sleep until just before the next measurement is due, then poll
+        # until it has been read, backing off while reads fail
+        give_up = time.monotonic() + max_wait
+        
+        self.sampler.wait()
+        while True:
+            try:
+                if self._read_measurement():
+                    break
+                
+                delay = self.sampler.not_ready()
+            except Exception as e:
+                delay = self.sampler.failed()
+                self._read_failed(e)
+                
+            if time.monotonic() >= give_up:
+                raise Exception("Reached max wait of {0}s reading the scd4x!".format(max_wait))
             
-            if attempt >= max_wait:
-                raise Exception("Reached max attempts of {0} reading the scd4x!".format(max_wait))
+            time.sleep(delay)
+            
+        if self._read_errors:
+            log.debug('Read the scd4x again after {} failures'.format(self._read_errors))
+            self._read_errors = 0
+            
+        self.sampler.ready()
             
         return True
 
     def close(self):
+        log.info('Read {} scd4x measurements in {} polls with {} failures, learned period {:.3f}s'.format(
+            self.sampler.samples, self.sampler.polls, self.sampler.errors, self.sampler.period
+            ))
+        
         self.i2c_transceiver.close()
         self._close()
 
@@ -143,53 +191,70 @@ class GroveRelay(object):
         self.i2c_address    = config.general['grove_relay_bus']
         self.i2c_command    = config.general['grove_relay_command']
         
-        self.channel_state = 0
+        self.events = None
+        if config.stream['enabled']:
+            self.events = EventPublisher(config.stream['socket_dir'])
+
+        # Timed actions of every channel share one thread
+        self.timers = TimerScheduler()
+        self.timers.start()
+
         self.bus = smbus.SMBus(self.i2c_bus)
-        self.bus.write_byte_data(
-            self.i2c_address, self.i2c_command, self.channel_state
-            )
-        
-    def _manage_sleep(self, sleep_timer):
-        if sleep_timer > 0:
-            time.sleep(sleep_timer)
-            
-    def _thread_function(self, func, *args, **kwargs):
-        thread = Thread(
-            target=func,
-            args=args,
-            kwargs=kwargs
-            )
-        thread.daemon = True
-        thread.start()
-        
-        return thread
-        
-    def _turn_on_channel(self, channel, device, sleep_timer):
-        self.channel_state |= (1 << (channel - 1))
+        self.register = RelayRegister(self.bus, self.i2c_address, self.i2c_command)
+        self.register.flush()
         
+    def _publish_state(self, channel, device, state):
+        if self.events:
+            self.events.publish(
+                'relay', ts=int(time.time() * 1000), channel=channel, device=device, state=state.name
+                )
+
+    def _turn_on_channel(self, channel, device):
         log.info('Enabling channel:{} Device:{}'.format(channel, device))
-        self.bus.write_byte_data(self.i2c_address, self.i2c_command, self.channel_state)
-        self._manage_sleep(sleep_timer)
+        self.register.set_channel(channel, True, self._publish_state, channel, device, RelayState.On)
 
-    def _turn_off_channel(self, channel, device, sleep_timer):
-        self.channel_state &= ~(1 << (channel - 1))
-        
+    def _turn_off_channel(self, channel, device, callback=None):
         log.info('Disabling channel:{} Device:{}'.format(channel, device))
-        self.bus.write_byte_data(self.i2c_address, self.i2c_command, self.channel_state)
-        self._manage_sleep(sleep_timer)
-        
-    def turn_on_channel(self, channel, device, threaded=False, thread_sleep=30):
-        if threaded:
-            thread = self._thread_function(self._turn_on_channel, *(channel, device, thread_sleep))
-            return thread
+        self.register.set_channel(channel, False, self._channel_off, channel, device, callback)
 
-        else:
-            self._turn_on_channel(channel, device, 0)
+    def _channel_off(self, channel, device, callback):
+        # Runs once the board has switched the channel off
+        self._publish_state(channel, device, RelayState.Off)
+        if callback:
+            callback(channel, device)
+        
+    def turn_on_channel(self, channel, device, duration=None, callback=None):
+        """Turns channel on and, given a duration, off again that many seconds
+        later on the relay's timer thread, then calls callback(channel, device)
+        once that write is done.
+        Returns the timer handle, or None without a duration."""
+        self._turn_on_channel(channel, device)
+        if duration is None:
+            return None
 
-        return None
+        return self.timers.schedule(duration, self._turn_off_channel, channel, device, callback)
         
     def turn_off_channel(self, channel, device):
-        self._turn_off_channel(channel, device, False)
+        self._turn_off_channel(channel, device)
+
+    def batch(self):
+        """Writes every channel change made in the with block at once"""
+        return self.register.batch()
+
+    def close(self):
+        # Channels still timed on are switched off now rather than left on
+        with self.batch():
+            self.timers.close(run_pending=True)
+
+        log.info('Ran {} timed relay actions, at most {:.3f}s late'.format(
+            self.timers.fired, self.timers.max_lateness
+            ))
+        log.info('Wrote the relay register {} times, skipped {} redundant writes, {:.2f}ms mean and {:.2f}ms max latency'.format(
+            self.register.writes,
+            self.register.skipped,
+            self.register.write_time / max(self.register.writes, 1) * 1000,
+            self.register.max_write_time * 1000
+            ))
 
 class GroveLCD(object):
     def __init__(self, config):        
@@ -0,0 +1,166 @@
+import logging
+import sqlite3
+import time
+
+from queue import Queue, Empty, Full
+from threading import Thread
+
+from lib.db import SQLite
+from lib.rollup import catch_up_rollups, update_rollups
+
+log = logging.getLogger()
+
+class BatchWriter(Thread):
+    """Write-behind queue for sensor output.  Rows are buffered in memory and
+    committed, along with the rollup buckets they touch, in a single
+    transaction every batch_size rows or batch_interval seconds, whichever
+    comes first, so at most that many rows are lost if the process dies.
+    Given a compactor, its retention passes run on the same connection every
+    compact_interval seconds, one short transaction between queue reads."""
+    _STOP = object()
+
+    def __init__(self, config, compactor=None):
+        super().__init__()
+        self.daemon = True
+
+        self._config            = config
+        self.compactor          = compactor
+        self.batch_size         = config.database['batch_size']
+        self.batch_interval     = config.database['batch_interval']
+        self.queue_size         = config.database['queue_size']
+        self.queue              = Queue(maxsize=self.queue_size)
+
+        self.rows_written       = 0
+        self.rows_dropped       = 0
+        self.commits            = 0
+
+    def put(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except Full:
+            self.rows_dropped += 1
+            log.warning('Sensor database queue is full, dropping row {}'.format(row))
+
+    def run(self):
+        # The writer thread owns the daemon's only write connection
+        db = SQLite.from_config(self._config)
+        pending = []
+        compaction = None
+
+        try:
+            catch_up_rollups(db.con)
+        except sqlite3.Error:
+            log.exception('Failed to catch up the rollup tables')
+
+        deadline = time.time() + self.batch_interval
+        compact_due = time.time()
+
+        try:
+            while True:
+                # Only wait for rows while no compaction steps are left to run
+                timeout = 0 if compaction else max(deadline - time.time(), 0)
+                if self.compactor and not compaction:
+                    timeout = min(timeout, max(compact_due - time.time(), 0))
+
+                try:
+                    row = self.queue.get(timeout=timeout)
+                except Empty:
+                    row = None
+
+                if row is self._STOP:
+                    break
+                elif row is not None:
+                    pending.append(row)
+
+                if len(pending) >= self.batch_size or time.time() >= deadline:
+                    pending = self._flush(db, pending)
+                    deadline = time.time() + self.batch_interval
+
+                if self.compactor and not compaction and time.time() >= compact_due:
+                    compaction = self.compactor.steps(db)
+                    compact_due = time.time() + self.compactor.interval
+
+                if compaction and not self._compact_step(db, compaction):
+                    compaction = None
+
+            # Drain anything queued before close was requested
+            while True:
+                try:
+                    row = self.queue.get_nowait()
+                except Empty:
+                    break
+                if row is not self._STOP:
+                    pending.append(row)
+
+            self._flush(db, pending)
+
+        finally:
+            if compaction:
+                compaction.close()
+            db.close()
+
+    def _compact_step(self, db, compaction):
+        """Runs the next compaction transaction, False once the pass is over"""
+        try:
+            next(compaction)
+            return True
+        except StopIteration:
+            return False
+        except sqlite3.Error:
+            log.exception('Failed to compact the sensor database')
+            if db.con.in_transaction:
+                db.con.rollback()
+            return False
+
+    def _flush(self, db, pending):
+        if not pending:
+            return pending
+
+        try:
+            with db.con:
+                db.insert_many(pending)
+                update_rollups(db.cur, min(row[0] for row in pending))
+            self.rows_written += len(pending)
+            self.commits += 1
+            return []
+
+        except sqlite3.Error:
+            log.exception('Failed to commit {} rows to the sensor database'.format(len(pending)))
+
+            # Keep the rows for the next attempt without growing past the queue bound
+            overflow = len(pending) - self.queue_size
+            if overflow > 0:
+                self.rows_dropped += overflow
+                pending = pending[overflow:]
+
+            return pending
+
+    def close(self, timeout=30):
+        """Stops the thread once the rows queued so far are written, waiting
+        at most timeout seconds.  Rows left queued by a thread that died are
+        counted as dropped."""
+        if self.is_alive():
+            try:
+                self.queue.put(self._STOP, timeout=timeout)
+                self.join(timeout)
+            except Full:
+                pass
+
+            if self.is_alive():
+                log.error('Sensor database writer did not stop within {}s, {} rows still queued'.format(
+                    timeout, self.queue.qsize()
+                    ))
+                return
+
+        dropped = 0
+        while True:
+            try:
+                row = self.queue.get_nowait()
+            except Empty:
+                break
+            if row is not self._STOP:
+                dropped += 1
+
+        if dropped:
+            self.rows_dropped += dropped
+            log.error('Sensor database writer is not running, dropped {} queued rows'.format(dropped))
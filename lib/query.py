@@ -0,0 +1,126 @@
+import logging
+import numpy as np
+
+from lib.db import READING_COLUMNS, READING_VARIABLES, ROLLUP_TIERS, MAX_TS, to_epoch_ms
+
+log = logging.getLogger()
+
+# Every query the web server issues against a time range.  Each one has to
+# be answered by a range search on its table's primary key; check_query_plans
+# verifies that, and tests/test_query_plans.py runs it on every change.
+RANGE_QUERY = "SELECT {columns} FROM readings WHERE ts >= ? AND ts < ? ORDER BY ts ASC;"
+BUCKET_QUERY = "SELECT (ts / ?) * ? AS bucket, {columns} FROM {table} " \
+    "WHERE ts >= ? AND ts < ? GROUP BY bucket ORDER BY bucket ASC;"
+SINCE_QUERY = "SELECT {columns} FROM readings WHERE ts > ? ORDER BY ts ASC LIMIT ?;"
+COUNT_QUERY = "SELECT count(*) FROM readings WHERE ts >= ? AND ts < ?;"
+LATEST_QUERY = "SELECT max(ts) FROM readings;"
+LATEST_READING_QUERY = "SELECT {columns} FROM readings WHERE ts = (SELECT max(ts) FROM readings);"
+
+# Columns returned per variable by select_buckets, in READING_VARIABLES order
+BUCKET_AGGREGATES = ['avg', 'min', 'max']
+
+def _bucket_columns(table):
+    columns = []
+    for column in READING_VARIABLES.values():
+        if table == 'readings':
+            columns += ['avg({0}), min({0}), max({0})'.format(column)]
+        else:
+            columns += ['sum({0}_sum) / sum({0}_count), min({0}_min), max({0}_max)'.format(column)]
+
+    return ', '.join(columns)
+
+RANGE_QUERIES = {
+    'readings'  : RANGE_QUERY.format(columns=', '.join(READING_COLUMNS)),
+    'since'     : SINCE_QUERY.format(columns=', '.join(READING_COLUMNS)),
+    'count'     : COUNT_QUERY,
+    'latest_ts' : LATEST_QUERY,
+    'latest'    : LATEST_READING_QUERY.format(columns=', '.join(READING_COLUMNS)),
+}
+for _table in ['readings'] + [table for table, seconds in ROLLUP_TIERS]:
+    RANGE_QUERIES[_table + '_buckets'] = BUCKET_QUERY.format(columns=_bucket_columns(_table), table=_table)
+
+def _range_params(start, end):
+    start = to_epoch_ms(start)
+    end = to_epoch_ms(end) if end is not None else MAX_TS
+
+    return start, end
+
+def select_range(cur, start, end=None, columns=None):
+    """Returns a cursor over readings between start (inclusive) and end
+    (exclusive).  start and end may be naive UTC datetimes or epoch seconds.
+    @param cur: sqlite cursor to execute the query on.
+    """
+    query = RANGE_QUERY.format(columns=', '.join(columns or READING_COLUMNS))
+
+    return cur.execute(query, _range_params(start, end))
+
+def count_range(cur, start, end=None):
+    """Returns the number of readings between start (inclusive) and end (exclusive)"""
+    return cur.execute(COUNT_QUERY, _range_params(start, end)).fetchone()[0]
+
+def select_since(cur, since, limit=5000):
+    """Returns up to limit readings newer than since (epoch milliseconds),
+    oldest first, for clients catching up from a cursor."""
+    return cur.execute(RANGE_QUERIES['since'], (int(since), int(limit)))
+
+def bucket_source(bucket):
+    """Returns the coarsest table whose buckets evenly divide bucket seconds"""
+    source = 'readings'
+    for table, seconds in ROLLUP_TIERS:
+        if bucket % seconds == 0:
+            source = table
+
+    return source
+
+def select_buckets(cur, start, end=None, bucket=60):
+    """Returns a cursor over bucket seconds wide time buckets between start
+    and end.  Each row is the bucket start followed by the avg, min and max of
+    every variable, aggregated in SQL from the coarsest table that can serve
+    the bucket size, so the row count is bounded by the range / bucket."""
+    table = bucket_source(bucket)
+    bucket_ms = int(bucket * 1000)
+
+    return cur.execute(
+        RANGE_QUERIES[table + '_buckets'], (bucket_ms, bucket_ms) + _range_params(start, end)
+        )
+
+def bucket_arrays(results):
+    """Decodes select_buckets results into a datetime64[ms] array of bucket
+    starts and a dict of avg, min and max float arrays per READING_VARIABLES
+    name, NaN where a bucket holds no sample of that variable."""
+    width = 1 + len(READING_VARIABLES) * len(BUCKET_AGGREGATES)
+    rows = np.array(results.fetchall(), dtype=np.float64).reshape(-1, width)
+
+    arrays = dict()
+    for idx, var in enumerate(READING_VARIABLES):
+        first = 1 + idx * len(BUCKET_AGGREGATES)
+        arrays[var] = dict(zip(BUCKET_AGGREGATES, rows[:, first:first + len(BUCKET_AGGREGATES)].T))
+
+    return rows[:, 0].astype(np.int64).astype('datetime64[ms]'), arrays
+
+def select_latest(cur):
+    """Returns the epoch milliseconds of the newest reading or None"""
+    return cur.execute(RANGE_QUERIES['latest_ts']).fetchone()[0]
+
+def select_latest_reading(cur):
+    """Returns the newest readings row or None"""
+    return cur.execute(RANGE_QUERIES['latest']).fetchone()
+
+def query_plan(cur, query, params=()):
+    """Returns the EXPLAIN QUERY PLAN detail lines for a query"""
+    return [row[-1] for row in cur.execute('EXPLAIN QUERY PLAN ' + query, params)]
+
+def check_query_plans(cur, queries=RANGE_QUERIES):
+    """Raises if any of the queries, by name, would scan a whole table
+    instead of searching an index for its time range."""
+    for name, query in queries.items():
+        # Bucket queries take the bucket size ahead of the range
+        params = (60000,) * (query.count('?') - 2) + _range_params(0, None) if '?' in query else ()
+        plan = query_plan(cur, query, params)
+        log.debug('Query plan for {}: {}'.format(name, plan))
+
+        for detail in plan:
+            if detail.startswith('SCAN') and 'CONSTANT ROW' not in detail:
+                raise Exception("Range query {} falls back to a full scan: {}".format(name, detail))
+
+    return True
@@ -0,0 +1,116 @@
+import logging
+import time
+
+from contextlib import contextmanager
+from threading import Lock
+
+log = logging.getLogger()
+
+class RelayRegister(object):
+    """Shadow copy of the relay board's channel register.  Channel changes
+    from every thread are applied to a target value under one lock, changes
+    made inside batch() are written together in a single I2C write, and a
+    write is skipped when the board already holds the target value.  A change's
+    callback runs once the write carrying it is done, outside the lock.  A
+    write that fails at the end of a batch or in flush() is logged and the
+    changes and their callbacks stay pending for the next one."""
+    def __init__(self, bus, address, command):
+        self.bus            = bus
+        self.address        = address
+        self.command        = command
+
+        self.target         = 0
+        self.shadow         = None
+
+        self.writes         = 0
+        self.skipped        = 0
+        self.write_time     = 0.0
+        self.max_write_time = 0.0
+
+        self._lock          = Lock()
+        self._batches       = 0
+        self._pending       = False
+        self._written       = []
+
+    def set_channel(self, channel, on, callback=None, *args):
+        """Sets channel in the target value and, once the board holds it,
+        calls callback(*args)"""
+        written = []
+        with self._lock:
+            if on:
+                self.target |= (1 << (channel - 1))
+            else:
+                self.target &= ~(1 << (channel - 1))
+
+            self._pending = True
+            if callback is not None:
+                self._written.append((callback, args))
+
+            if not self._batches:
+                written = self._flush()
+
+        self._run(written)
+
+    @contextmanager
+    def batch(self):
+        """Defers writes from any thread until the outermost batch ends"""
+        with self._lock:
+            self._batches += 1
+
+        try:
+            yield self
+        finally:
+            written = []
+            with self._lock:
+                self._batches -= 1
+                if not self._batches and self._pending:
+                    written = self._retry_flush()
+
+            self._run(written)
+
+    def flush(self):
+        with self._lock:
+            written = self._retry_flush()
+
+        self._run(written)
+
+    def _run(self, written):
+        for callback, args in written:
+            try:
+                callback(*args)
+            except:
+                log.exception('Failed to run relay callback {}'.format(callback))
+
+    def _retry_flush(self):
+        try:
+            return self._flush()
+        except Exception as e:
+            log.exception('Failed to write the relay register, retrying with the next write: {}'.format(e))
+            return []
+
+    def _flush(self):
+        # Returns the callbacks of the changes now on the board, a failed
+        # write leaves them pending with the changes
+        written, self._written = self._written, []
+        if self.target == self.shadow:
+            self._pending = False
+            self.skipped += 1
+            return written
+
+        # The board's value is unknown until a write succeeds
+        self.shadow = None
+        start = time.perf_counter()
+        try:
+            self.bus.write_byte_data(self.address, self.command, self.target)
+        except:
+            self._written = written + self._written
+            raise
+        elapsed = time.perf_counter() - start
+
+        self.shadow = self.target
+        self._pending = False
+        self.writes += 1
+        self.write_time += elapsed
+        self.max_write_time = max(self.max_write_time, elapsed)
+
+        return written
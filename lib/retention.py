@@ -0,0 +1,117 @@
+import logging
+import time
+
+from lib.db import ROLLUP_TIERS
+
+log = logging.getLogger()
+
+# Tables in compaction order, each one downsampled into the next
+RETENTION_TABLES = ['readings'] + [table for table, seconds in ROLLUP_TIERS]
+
+class Compactor(object):
+    """Enforces the per-table retention policy.  Expired rows are deleted in
+    small transactions whose size adapts to keep each one short, and rows are
+    only removed once the next coarser tier has absorbed them.  Freed pages
+    are handed back to the filesystem with incremental vacuum.  Passes run on
+    the BatchWriter's connection, one transaction per step, so the daemon
+    keeps a single writer and sensor rows are flushed in between steps."""
+    def __init__(self, config, max_lock=0.05):
+        self.retention      = {
+            table: config.database['{}_retention_days'.format(table)] for table in RETENTION_TABLES
+            }
+        self.interval       = config.database['compact_interval']
+        self.batch_size     = config.database['compact_batch_size']
+        self.vacuum_pages   = config.database['vacuum_pages']
+        self.max_lock       = max_lock
+
+        self.rows_deleted   = 0
+        self.pages_freed    = 0
+
+    def _cutoff(self, db, idx):
+        table = RETENTION_TABLES[idx]
+        days = self.retention.get(table, 0)
+        if not days:
+            return None
+
+        cutoff = int((time.time() - days * 86400) * 1000)
+
+        # Never drop rows the next tier has not rolled up yet
+        if idx + 1 < len(RETENTION_TABLES):
+            rolled_up = db.cur.execute(
+                "SELECT max(ts) FROM {};".format(RETENTION_TABLES[idx + 1])
+                ).fetchone()[0]
+            if rolled_up is None:
+                return None
+            cutoff = min(cutoff, rolled_up)
+
+        return cutoff
+
+    def compact(self, db):
+        """Runs a whole pass at once"""
+        for _ in self.steps(db):
+            pass
+
+    def steps(self, db):
+        """Generator running one pass, one transaction per step"""
+        for idx, table in enumerate(RETENTION_TABLES):
+            cutoff = self._cutoff(db, idx)
+            if cutoff is None:
+                continue
+
+            deleted = 0
+            for count in self._delete_before(db, table, cutoff):
+                deleted += count
+                yield
+
+            if deleted:
+                log.info('Compacted {} rows from {}'.format(deleted, table))
+
+        for _ in self._incremental_vacuum(db):
+            yield
+
+        # Keep the write-ahead log from growing between automatic checkpoints.
+        # A passive checkpoint never waits on the web server's readers.
+        if db.cur.execute("PRAGMA journal_mode;").fetchone()[0] == 'wal':
+            db.checkpoint('PASSIVE')
+
+    def _delete_before(self, db, table, cutoff):
+        while True:
+            batch_end = db.cur.execute(
+                "SELECT ts FROM {} WHERE ts < ? ORDER BY ts LIMIT 1 OFFSET ?;".format(table),
+                (cutoff, self.batch_size)
+                ).fetchone()
+            batch_end = batch_end[0] if batch_end else cutoff
+
+            start = time.time()
+            with db.con:
+                db.cur.execute("DELETE FROM {} WHERE ts < ?;".format(table), (batch_end,))
+                count = db.cur.rowcount
+            self._adapt_batch_size(time.time() - start)
+
+            self.rows_deleted += count
+            yield count
+
+            if batch_end >= cutoff or not count:
+                break
+
+    def _adapt_batch_size(self, elapsed):
+        if elapsed > self.max_lock:
+            self.batch_size = max(self.batch_size // 2, 10)
+        elif elapsed < self.max_lock / 4:
+            self.batch_size = min(self.batch_size * 2, 10000)
+
+    def _incremental_vacuum(self, db):
+        if db.cur.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            log.debug('Incremental vacuum is not enabled on {}, run "dbtool.py vacuum"'.format(db.path))
+            return
+
+        while True:
+            free_pages = db.cur.execute("PRAGMA freelist_count;").fetchone()[0]
+            if not free_pages:
+                break
+
+            # executescript steps the pragma to completion, execute would
+            # only free a single page
+            db.cur.executescript("PRAGMA incremental_vacuum({});".format(self.vacuum_pages))
+            self.pages_freed += min(free_pages, self.vacuum_pages)
+            yield
@@ -0,0 +1,100 @@
+import logging
+
+from lib.db import READING_VARIABLES, ROLLUP_TIERS, ROLLUP_AGGREGATES, MAX_TS
+
+log = logging.getLogger()
+
+# Bucket ranges recomputed per transaction while catching up after downtime
+CATCH_UP_CHUNK = 24 * 3600 * 1000
+
+def _tier_select(source, bucket_ms):
+    """Builds the aggregate select for one tier from either the raw readings
+    table or the next finer rollup tier."""
+    fields = ['(ts / {0}) * {0}'.format(bucket_ms)]
+    for column in READING_VARIABLES.values():
+        if source == 'readings':
+            fields += [
+                'min({})'.format(column),
+                'max({})'.format(column),
+                'sum({})'.format(column),
+                'count({})'.format(column)
+                ]
+        else:
+            fields += [
+                'min({}_min)'.format(column),
+                'max({}_max)'.format(column),
+                'sum({}_sum)'.format(column),
+                'sum({}_count)'.format(column)
+                ]
+
+    return "SELECT {} FROM {} WHERE ts >= ? AND ts < ? GROUP BY 1".format(', '.join(fields), source)
+
+def _tier_columns():
+    columns = ['ts']
+    for column in READING_VARIABLES.values():
+        columns += ['{}_{}'.format(column, aggregate) for aggregate in ROLLUP_AGGREGATES]
+
+    return columns
+
+def _rollup_queries():
+    queries = []
+    source = 'readings'
+    for table, seconds in ROLLUP_TIERS:
+        queries.append((
+            seconds * 1000,
+            "INSERT OR REPLACE INTO {} ({}) {};".format(
+                table, ', '.join(_tier_columns()), _tier_select(source, seconds * 1000)
+                )
+            ))
+        source = table
+
+    return queries
+
+ROLLUP_QUERIES = _rollup_queries()
+
+def update_rollups(cur, since, until=None):
+    """Recomputes every rollup bucket touching readings from since (epoch ms)
+    up to until.  Buckets are rebuilt from the tier below them so running this
+    for a partially filled bucket is safe and idempotent.
+    @param cur: sqlite cursor; the caller owns the transaction.
+    """
+    for bucket_ms, query in ROLLUP_QUERIES:
+        start = since - since % bucket_ms
+        end = MAX_TS if until is None else -(-until // bucket_ms) * bucket_ms
+        cur.execute(query, (start, end))
+
+def catch_up_rollups(con):
+    """Brings the rollup tiers up to date with readings written while the
+    daemon was not maintaining them, one day of buckets per transaction."""
+    cur = con.cursor()
+    finest = ROLLUP_TIERS[0][0]
+    coarsest_ms = ROLLUP_TIERS[-1][1] * 1000
+
+    since = cur.execute("SELECT max(ts) FROM {};".format(finest)).fetchone()[0]
+    if since is None:
+        since = cur.execute("SELECT min(ts) FROM readings;").fetchone()[0]
+    latest = cur.execute("SELECT max(ts) FROM readings;").fetchone()[0]
+
+    if since is None or latest is None or since > latest:
+        cur.close()
+        return
+
+    since -= since % coarsest_ms
+    log.info('Catching up rollups from {} to {}'.format(since, latest))
+
+    while since <= latest:
+        with con:
+            update_rollups(cur, since, since + CATCH_UP_CHUNK)
+        since += CATCH_UP_CHUNK
+
+    cur.close()
+
+def select_tier(timespan, min_points=200):
+    """Returns the coarsest rollup table that still yields min_points buckets
+    over timespan seconds, or None when only raw readings are fine enough.
+    """
+    for table, seconds in reversed(ROLLUP_TIERS):
+        if timespan / seconds >= min_points:
+            return table
+
+    return None
@@ -0,0 +1,112 @@
+import logging
+import time
+
+log = logging.getLogger()
+
+class SampleScheduler:
+    """Predicts when a periodic sensor next has data ready, so the time in
+    between is slept through rather than spent polling the bus.  The period
+    starts at the nominal value and is learned from data ready transitions
+    seen while polling; the phase follows the last sample read.  Polling
+    starts a guard ahead of the prediction that tracks how far off recent
+    predictions were.
+    @param period: nominal seconds between samples.
+    @param min_guard: fewest seconds before the predicted sample to start polling.
+    @param poll_interval: seconds between polls once polling.
+    @param smoothing: weight of each new period and error measurement.
+    """
+    def __init__(self, period, min_guard=0.04, poll_interval=0.02, smoothing=0.1):
+        self.period = float(period)
+        self.min_guard = min_guard
+        self.guard = self.period / 4
+        self.poll_interval = poll_interval
+        self.smoothing = smoothing
+        self.error = self.guard
+
+        self.polls = 0
+        self.samples = 0
+        self.errors = 0
+        self.failures = 0
+
+        self._last_ready = None
+        self._window_open = None
+        self._first_poll = False
+        self._coarse = False
+
+    def next_deadline(self):
+        """Returns the monotonic time the next sample is expected, or None
+        before the first sample"""
+        if self._last_ready is None:
+            return None
+
+        return self._last_ready + self.period
+
+    def wait_time(self):
+        """Returns the seconds left until polling for the next sample starts"""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return 0.0
+
+        return max(deadline - self.guard - time.monotonic(), 0.0)
+
+    def wait(self):
+        """Sleeps until just before the next sample is expected"""
+        deadline = self.next_deadline()
+        delay = self.wait_time()
+        if delay > 0:
+            time.sleep(delay)
+
+        self._window_open = time.monotonic()
+        self._first_poll = True
+        self._coarse = deadline is None
+
+    def not_ready(self):
+        """Records a poll that found no data and returns the seconds to sleep
+        before polling again"""
+        self.polls += 1
+        self.failures = 0
+        self._first_poll = False
+
+        # Without a phase, or once the sample is well overdue, poll coarsely
+        # until one is read
+        deadline = self.next_deadline()
+        if deadline is None or time.monotonic() > deadline + self.period / 2:
+            self._coarse = True
+            return self.period / 10
+
+        return self.poll_interval
+
+    def failed(self):
+        """Records a poll that failed and returns the seconds to sleep before
+        trying again, doubling with each failure in a row up to the period"""
+        self.errors += 1
+        self.failures += 1
+        self._first_poll = False
+        self._coarse = True
+
+        return min(self.poll_interval * 2 ** self.failures, self.period)
+
+    def ready(self):
+        """Records a poll that found data and updates the period and phase"""
+        now = time.monotonic()
+        self.polls += 1
+        self.samples += 1
+        self.failures = 0
+
+        if self._last_ready is not None and self._first_poll:
+            # The data was ready before polling started, so the phase is
+            # earlier than predicted; pull it back so the next window opens
+            # before the sample rather than after it
+            now = self._window_open - self.guard
+
+        elif self._last_ready is not None and not self._coarse:
+            # Only transitions seen by tight polling time the period, counting
+            # any samples missed in between
+            elapsed = now - self._last_ready
+            cycles = max(round(elapsed / self.period), 1)
+            self.error += self.smoothing * (abs(elapsed - cycles * self.period) - self.error)
+            self.period += self.smoothing * (elapsed / cycles - self.period)
+
+        self.guard = min(max(4 * self.error, self.min_guard), self.period / 4)
+
+        self._last_ready = now
@@ -0,0 +1,97 @@
+import heapq
+import itertools
+import logging
+import time
+
+from threading import Condition, Thread
+
+log = logging.getLogger()
+
+class TimerScheduler(Thread):
+    """Runs callbacks at their deadlines from a single thread.  Pending timers
+    are kept in a heap ordered by monotonic deadline and the thread sleeps
+    until the earliest one, woken early only when a sooner one is added."""
+    def __init__(self):
+        super().__init__()
+        self.daemon = True
+
+        self.fired          = 0
+        self.max_lateness   = 0.0
+
+        self._timers        = []
+        self._counter       = itertools.count()
+        self._condition     = Condition()
+        self._closed        = False
+
+    def schedule(self, delay, callback, *args):
+        """Runs callback(*args) after delay seconds and returns a handle that
+        can be passed to cancel"""
+        with self._condition:
+            if self._closed:
+                raise Exception("Unable to schedule {}, the timer scheduler is closed".format(callback))
+
+            # The counter keeps equal deadlines in order and callbacks uncompared
+            timer = [time.monotonic() + delay, next(self._counter), callback, args]
+            heapq.heappush(self._timers, timer)
+            if self._timers[0] is timer:
+                self._condition.notify()
+
+        return timer
+
+    def cancel(self, timer):
+        """Drops a pending timer, cancelled timers stay in the heap until due"""
+        with self._condition:
+            timer[2] = None
+
+    def pending(self):
+        with self._condition:
+            return sum(1 for timer in self._timers if timer[2] is not None)
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if not self._timers:
+                        self._condition.wait()
+                        continue
+
+                    delay = self._timers[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+
+                    self._condition.wait(delay)
+
+                if self._closed:
+                    return
+
+                timer = heapq.heappop(self._timers)
+
+            self._fire(timer)
+
+    def _fire(self, timer):
+        deadline, _, callback, args = timer
+        if callback is None:
+            return
+
+        self.fired += 1
+        self.max_lateness = max(self.max_lateness, time.monotonic() - deadline)
+        try:
+            callback(*args)
+        except:
+            log.exception('Failed to run timer callback {}'.format(callback))
+
+    def close(self, run_pending=True):
+        """Stops the thread, first running every pending callback in deadline
+        order when run_pending"""
+        with self._condition:
+            self._closed = True
+            pending = sorted(self._timers)
+            self._timers = []
+            self._condition.notify()
+
+        if self.is_alive():
+            self.join()
+
+        if run_pending:
+            for timer in pending:
+                self._fire(timer)
@@ -0,0 +1,16 @@
+from collections import namedtuple
+
+# Static description of a measured variable, shared by the controllers and the
+# web dashboard so neither has to build a Controller just to label a chart
+Variable = namedtuple(
+    'Variable', ['name', 'description', 'chart_unit', 'chart_range_min', 'chart_range_max', 'chart_color']
+    )
+
+# Keyed by controller name, the same keys as lib.db.READING_VARIABLES
+VARIABLES = {
+    'CO2'                   : Variable('co2', 'CO2', 'ppm', 0, 4000, 'cyan'),
+    'Humidity'              : Variable('humidity', 'Humidity', '% RH', 35, 100, 'orangered'),
+    'TemperatureFarenheit'  : Variable('tempF', 'Temp Farenheit', '&deg;', 50, 100, 'lawngreen'),
+    'TemperatureCelsius'    : Variable('tempC', 'Temp Celsius', '&deg;', 15, 40, 'fuchsia'),
+    'Light'                 : Variable('light', 'Light', None, 0, 0, None)
+}
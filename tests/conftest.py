@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# lib is imported from the repository root and wfastcgi from Web, as the
+# daemon and the web server do
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'Web'))
+
+@pytest.fixture
+def config(tmp_path):
+    return SimpleNamespace(database={
+        'path'                      : str(tmp_path / 'ClimateControlDB'),
+        'without_rowid'             : False,
+        'journal_mode'              : 'WAL',
+        'synchronous'               : 'NORMAL',
+        'wal_autocheckpoint'        : 1000,
+        'busy_timeout'              : 5000,
+        'batch_size'                : 10,
+        'batch_interval'            : 0.05,
+        'queue_size'                : 100,
+        'readings_retention_days'   : 14,
+        'rollup_1m_retention_days'  : 0,
+        'rollup_15m_retention_days' : 0,
+        'rollup_1h_retention_days'  : 0,
+        'compact_interval'          : 3600,
+        'compact_batch_size'        : 50,
+        'vacuum_pages'              : 10
+        })
+
+@pytest.fixture
+def berlin():
+    tz = os.environ.get('TZ')
+    os.environ['TZ'] = 'Europe/Berlin'
+    time.tzset()
+    yield
+    if tz is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = tz
+    time.tzset()
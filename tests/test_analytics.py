@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from lib.analytics import local_hour_mask, local_hours, range_stats, variable_stats, weighted_percentiles
+from lib.db import SQLite
+from lib.rollup import catch_up_rollups
+
+# 2024-03-31 00:00 UTC, Berlin moves from UTC+1 to UTC+2 at 01:00 UTC
+DST_CHANGE = 1711843200000
+HOUR = 3600 * 1000
+
+def test_local_hours_follow_dst(berlin):
+    ts = np.array([DST_CHANGE - HOUR, DST_CHANGE + HOUR // 2, DST_CHANGE + HOUR * 3 // 2, DST_CHANGE + 5 * HOUR], dtype=np.float64)
+    assert local_hours(ts).tolist() == [0, 1, 3, 7]
+
+def test_local_hour_mask_wraps_midnight(berlin):
+    ts = np.arange(DST_CHANGE - 6 * HOUR, DST_CHANGE + 6 * HOUR, HOUR, dtype=np.float64)
+    hours = local_hours(ts)
+
+    assert local_hour_mask(ts, (22, 6)).tolist() == ((hours >= 22) | (hours < 6)).tolist()
+    assert local_hour_mask(ts, (3, 5)).tolist() == [hour in (3, 4) for hour in hours]
+
+def test_weighted_percentiles():
+    values = np.array([1.0, 2.0, 3.0, 4.0])
+    assert weighted_percentiles(values, np.ones(4), [0, 50, 100]).tolist() == [1.0, 2.0, 4.0]
+    # A heavy bucket pulls the median to it
+    assert weighted_percentiles(values, np.array([1.0, 1.0, 10.0, 1.0]), [50]).tolist() == [3.0]
+
+def test_variable_stats_band():
+    values = np.array([70.0, 80.0, 84.0, 86.0, 90.0, np.nan])
+    weights = np.array([1.0, 1.0, 1.0, 1.0, 0.0, 1.0])
+
+    stats = variable_stats(values, weights, values, values, [50], band=(75.0, 85.0))
+    assert stats['samples'] == 4
+    assert stats['min'] == 70.0 and stats['max'] == 86.0
+    assert stats['mean'] == pytest.approx(80.0)
+    assert stats['band'] == {'low': 75.0, 'high': 85.0, 'below': 0.25, 'inside': 0.5, 'above': 0.25}
+
+def test_variable_stats_without_samples():
+    empty = np.array([])
+    assert variable_stats(empty, empty, empty, empty, [50]) == {'samples': 0}
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLite(str(tmp_path / 'ClimateControlDB'))
+    start = 1704067200000
+    db.insert_many([(start + idx * 5000, 400.0 + idx % 100, 21.0, 69.8, 85.0) for idx in range(7 * 24 * 720)])
+    db.con.commit()
+    catch_up_rollups(db.con)
+    yield db, start
+    db.close()
+
+def test_range_stats_sources_agree(db):
+    db, start = db
+    end = start + 7 * 24 * HOUR
+
+    raw = range_stats(db.cur, start / 1000, end / 1000, ['CO2'], max_rows=10 ** 6)
+    rolled_up = range_stats(db.cur, start / 1000, end / 1000, ['CO2'], max_rows=1000)
+
+    assert raw['source'] == 'readings'
+    assert rolled_up['source'] == 'rollup_15m'
+    assert raw['variables']['CO2']['samples'] == rolled_up['variables']['CO2']['samples'] == 7 * 24 * 720
+    assert raw['variables']['CO2']['mean'] == pytest.approx(rolled_up['variables']['CO2']['mean'])
+    assert raw['variables']['CO2']['min'] == rolled_up['variables']['CO2']['min'] == 400.0
+    assert raw['variables']['CO2']['max'] == rolled_up['variables']['CO2']['max'] == 499.0
+
+@pytest.fixture
+def young_db(tmp_path):
+    # Three hours of readings starting mid-hour, as on a new install
+    db = SQLite(str(tmp_path / 'ClimateControlDB'))
+    start = 1704067200000 + 17 * 60 * 1000 + 2500
+    db.insert_many([(start + idx * 5000, 400.0 + idx % 100, 21.0, 69.8, 85.0) for idx in range(3 * 720)])
+    db.con.commit()
+    catch_up_rollups(db.con)
+    yield db, start
+    db.close()
+
+def test_range_before_first_reading_uses_readings(young_db):
+    db, start = young_db
+    end = start + 3 * HOUR
+
+    day = range_stats(db.cur, (end - 24 * HOUR) / 1000, end / 1000, ['CO2'])
+    assert day['source'] == 'readings'
+    assert day['variables']['CO2']['samples'] == 3 * 720
+
+    # A range longer than the row limit allows, counted from the first reading
+    week = range_stats(db.cur, (end - 7 * 24 * HOUR) / 1000, end / 1000, ['CO2'], max_rows=1000)
+    assert week['source'] == 'rollup_1m'
+
+def test_compacted_readings_not_used_before_their_start(young_db):
+    db, start = young_db
+    end = start + 3 * HOUR
+    db.cur.execute('DELETE FROM readings WHERE ts < ?', (start + HOUR,))
+    db.con.commit()
+
+    stats = range_stats(db.cur, (end - 24 * HOUR) / 1000, end / 1000, ['CO2'])
+    assert stats['source'] == 'rollup_1m'
+    assert stats['variables']['CO2']['samples'] == 3 * 720
+
+    # Within what the readings still hold they are used as before
+    assert range_stats(db.cur, (start + HOUR) / 1000, end / 1000, ['CO2'])['source'] == 'readings'
@@ -0,0 +1,82 @@
+import importlib.util
+import os
+import threading
+
+import pytest
+
+import lib.config
+from conftest import ROOT
+
+# Loaded on its own, importing the ClimateControl package starts the whole app
+spec = importlib.util.spec_from_file_location('cache', os.path.join(ROOT, 'Web', 'ClimateControl', 'cache.py'))
+cache = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cache)
+
+def test_new_version_renders_again():
+    renders = []
+    render_cache = cache.RenderCache(4)
+
+    for version in [1, 1, 2, 2]:
+        render_cache.get_or_render('page', version, lambda: renders.append(version) or 'v{}'.format(version))
+
+    assert renders == [1, 2]
+    assert (render_cache.hits, render_cache.misses) == (2, 2)
+
+def test_render_locks_removed():
+    render_cache = cache.RenderCache(4)
+    render_cache.get_or_render('page', 1, lambda: 'page')
+
+    def fail():
+        raise RuntimeError('render failed')
+
+    with pytest.raises(RuntimeError):
+        render_cache.get_or_render('broken', 1, fail)
+
+    assert render_cache._render_locks == {}
+    assert 'broken' not in render_cache.entries
+
+def test_concurrent_misses_render_once():
+    renders = []
+    started = threading.Event()
+    release = threading.Event()
+    render_cache = cache.RenderCache(4)
+
+    def render():
+        renders.append(1)
+        started.set()
+        release.wait()
+        return 'page'
+
+    threads = [threading.Thread(target=render_cache.get_or_render, args=('page', 1, render)) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert renders == [1]
+    assert render_cache._render_locks == {}
+
+@pytest.fixture
+def conf_root(tmp_path, monkeypatch):
+    (tmp_path / 'conf' / 'profiles').mkdir(parents=True)
+    (tmp_path / 'conf' / 'ClimateControl.conf').write_text('[general]\nprofile = test\n')
+    (tmp_path / 'conf' / 'profiles' / 'test.conf').write_text('[Light]\ncontrol_on_hr = 6\n')
+    monkeypatch.setattr(lib.config, 'APP_ROOT', str(tmp_path))
+    return tmp_path
+
+def test_config_reloaded_with_new_mtimes(conf_root):
+    config_cache = lib.config.ConfigCache()
+    config = config_cache.get()
+    assert config_cache.get() is config
+
+    profile = conf_root / 'conf' / 'profiles' / 'test.conf'
+    profile.write_text('[Light]\ncontrol_on_hr = 7\n')
+    os.utime(str(profile), ns=(0, config.mtimes[1] + 10 ** 9))
+
+    reloaded = config_cache.get()
+    assert reloaded is not config
+    assert reloaded.Light['control_on_hr'] == 7
+    assert reloaded.mtimes != config.mtimes
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from lib.controllers import Controller, RelayState
+
+def local(year, month, day, hour, minute=0):
+    return time.mktime((year, month, day, hour, minute, 0, 0, 0, -1))
+
+def controller(method, **settings):
+    controller = Controller(None, None)
+    controller.control_enabled = True
+    controller.control_method = method
+    controller.control_device = 'device'
+    for name, value in settings.items():
+        setattr(controller, name, value)
+
+    return controller
+
+@pytest.mark.parametrize('method', ['threshold', None])
+def test_sample_driven_control_has_no_deadline(method):
+    assert controller(method).next_deadline(time.time()) is None
+
+def test_disabled_or_deviceless_control_has_no_deadline():
+    assert controller('frequency', control_enabled=False).next_deadline(time.time()) is None
+    assert controller('schedule', control_device=None).next_deadline(time.time()) is None
+
+def test_frequency_deadlines():
+    now = 1000000.0
+    offset = controller('frequency', control_frequency=600, control_offset=60, frequency_time=now - 30)
+    assert offset.next_deadline(now) == now + 30
+
+    offset.frequency_started = True
+    assert offset.next_deadline(now) == now + 570
+
+    unstarted = controller('frequency', control_frequency=600, control_offset=None)
+    assert unstarted.next_deadline(now) == now
+
+@pytest.mark.parametrize('now, status, expected', [
+    # Inside the schedule the next change is its end, outside its start
+    ((2024, 1, 10, 10, 30), RelayState.On, (2024, 1, 10, 22)),
+    ((2024, 1, 10, 23, 10), RelayState.Off, (2024, 1, 11, 6)),
+    ((2024, 1, 31, 23, 59), RelayState.Off, (2024, 2, 1, 6)),
+    ((2024, 1, 10, 5, 0), RelayState.Off, (2024, 1, 10, 6)),
+    ])
+def test_schedule_deadline(berlin, now, status, expected):
+    schedule = controller('schedule', control_on_hr=6, control_off_hr=22, status=status)
+    assert schedule.next_deadline(local(*now)) == local(*expected)
+
+def test_schedule_out_of_step_is_due_now(berlin):
+    now = local(2024, 1, 10, 10, 30)
+    assert controller('schedule', control_on_hr=6, control_off_hr=22).next_deadline(now) == now
+
+# 2024-03-31 01:00 UTC Berlin skips from 02:00 to 03:00, on 2024-10-27
+# 01:00 UTC it goes back from 03:00 to 02:00
+SPRING_FORWARD = 1711846800
+FALL_BACK = 1729990800
+
+def test_schedule_deadline_spring_forward(berlin):
+    # 00:30 CET to 03:00 CEST is an hour and a half
+    schedule = controller('schedule', control_on_hr=3, control_off_hr=23)
+    assert schedule.next_deadline(SPRING_FORWARD - 1800) == SPRING_FORWARD
+
+def test_schedule_deadline_fall_back(berlin):
+    # 01:30 CEST to 04:00 CET is three and a half hours
+    schedule = controller('schedule', control_on_hr=0, control_off_hr=4, status=RelayState.On)
+    now = FALL_BACK - 5400
+    assert time.localtime(now).tm_hour == 1
+    assert schedule.next_deadline(now) == now + 3.5 * 3600
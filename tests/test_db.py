@@ -0,0 +1,73 @@
+import sqlite3
+
+from datetime import datetime
+
+import pytest
+
+from lib.db import SQLite, to_epoch_ms
+
+LEGACY_ROWS = [
+    ('2024-01-01 00:00:00', 'CO2', 612.0),
+    ('2024-01-01 00:00:00', 'TemperatureCelsius', 21.5),
+    ('2024-01-01 00:00:00', 'TemperatureFarenheit', 70.7),
+    ('2024-01-01 00:00:00', 'Humidity', 85.25),
+    ('2024-01-01 00:00:05.250000', 'CO2', 615.0),
+    ('2024-01-01 00:00:05.250000', 'Humidity', 85.5),
+    ('2024-01-01 00:00:05.250000', 'Pressure', 1013.0),
+    ('2024-01-01 00:00:10', 'TemperatureCelsius', 21.75),
+]
+
+@pytest.fixture
+def legacy_path(tmp_path):
+    path = str(tmp_path / 'ClimateControlDB')
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE sensorout(date DATE, var TEXT, value FLOAT)")
+    con.executemany("INSERT INTO sensorout (date,var,value) VALUES (?,?,?);", LEGACY_ROWS)
+    con.commit()
+    con.close()
+
+    return path
+
+def readings(db):
+    return db.cur.execute("SELECT ts, co2, tempC, tempF, humidity FROM readings ORDER BY ts").fetchall()
+
+EXPECTED = [
+    (1704067200000, 612.0, 21.5, 70.7, 85.25),
+    (1704067205250, 615.0, None, None, 85.5),
+    (1704067210000, None, 21.75, None, None),
+]
+
+def test_to_epoch_ms():
+    assert to_epoch_ms(datetime(2024, 1, 1)) == 1704067200000
+    assert to_epoch_ms('2024-01-01 00:00:05.250000') == 1704067205250
+    assert to_epoch_ms(1704067205.25) == 1704067205250
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 20000])
+def test_migrate_merges_variables_into_wide_rows(legacy_path, chunk_size):
+    db = SQLite(legacy_path)
+    try:
+        assert db.migrate_sensorout(chunk_size) == len(LEGACY_ROWS)
+        assert readings(db) == EXPECTED
+
+        tables = [row[0] for row in db.cur.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        assert 'sensorout' not in tables
+    finally:
+        db.close()
+
+def test_interrupted_migration_can_run_again(legacy_path):
+    db = SQLite(legacy_path)
+    try:
+        db.migrate_sensorout(3, drop=False)
+        # Running again over rows already copied changes nothing
+        assert db.migrate_sensorout(3, drop=False) == len(LEGACY_ROWS)
+        assert readings(db) == EXPECTED
+    finally:
+        db.close()
+
+def test_migrate_without_sensorout(tmp_path):
+    db = SQLite(str(tmp_path / 'ClimateControlDB'))
+    try:
+        assert db.migrate_sensorout() == 0
+        assert readings(db) == []
+    finally:
+        db.close()
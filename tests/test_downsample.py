@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+import pytest
+
+from lib.downsample import lttb, lttb_indices
+
+def reference_lttb(x, y, threshold):
+    """Steinarsson's reference Largest-Triangle-Three-Buckets"""
+    length = len(x)
+    every = (length - 2) / (threshold - 2)
+    selected = 0
+    indices = [0]
+
+    for bucket in range(threshold - 2):
+        avg_start = int(math.floor((bucket + 1) * every)) + 1
+        avg_end = min(int(math.floor((bucket + 2) * every)) + 1, length)
+        avg_x = sum(x[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(y[avg_start:avg_end]) / (avg_end - avg_start)
+
+        start = int(math.floor(bucket * every)) + 1
+        end = int(math.floor((bucket + 1) * every)) + 1
+
+        best, best_area = start, -1
+        for idx in range(start, end):
+            area = abs((x[selected] - avg_x) * (y[idx] - y[selected]) - (x[selected] - x[idx]) * (avg_y - y[selected]))
+            if area > best_area:
+                best, best_area = idx, area
+
+        indices.append(best)
+        selected = best
+
+    indices.append(length - 1)
+    return indices
+
+@pytest.mark.parametrize('length,threshold', [(10, 3), (100, 7), (1000, 50), (5003, 800), (801, 800)])
+def test_matches_reference(length, threshold):
+    rand = np.random.default_rng(length)
+    x = np.cumsum(rand.uniform(1, 10, length))
+    y = rand.normal(0, 1, length).cumsum()
+
+    assert lttb_indices(x, y, threshold).tolist() == reference_lttb(x.tolist(), y.tolist(), threshold)
+
+def test_keeps_ends_and_spikes():
+    x = np.arange(10000)
+    y = np.zeros(10000)
+    y[4321] = 100.0
+    y[7777] = -50.0
+
+    indices = lttb_indices(x, y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 9999
+    assert np.all(np.diff(indices) > 0)
+    assert 4321 in indices and 7777 in indices
+
+def test_short_series_are_kept_whole():
+    x = np.arange(5)
+    assert lttb_indices(x, x, 5).tolist() == [0, 1, 2, 3, 4]
+    assert lttb_indices(x, x, 800).tolist() == [0, 1, 2, 3, 4]
+    assert lttb_indices(x, x, 2).tolist() == [0, 1, 2, 3, 4]
+
+def test_datetime_series():
+    x = np.arange(0, 1000 * 5000, 5000).astype('datetime64[ms]')
+    y = np.sin(np.arange(1000) / 50.0)
+
+    sampled_x, sampled_y = lttb(x.view(np.int64), y, 100)
+    assert len(sampled_x) == len(sampled_y) == 100
+    assert sampled_x[0] == 0 and sampled_x[-1] == 999 * 5000
@@ -0,0 +1,66 @@
+import csv
+import io
+import math
+
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from lib.db import SQLite
+from lib.export import export, parse_bound, EXPORT_DTYPE
+
+@pytest.mark.parametrize('value,expected', [
+    (None, None),
+    (0, 0.0),
+    ('1704067200', 1704067200.0),
+    ('1704067200.5', 1704067200.5),
+    ('2024-01-01', datetime(2024, 1, 1)),
+    ('2024-01-01T12:30:00', datetime(2024, 1, 1, 12, 30)),
+    ('2024-01-01T12:30:00+02:00', datetime(2024, 1, 1, 10, 30)),
+])
+def test_parse_bound(value, expected):
+    assert parse_bound(value) == expected
+
+@pytest.mark.parametrize('value', ['yesterday', '2024-13-01', '', 'nan', 'inf', '1e300'])
+def test_parse_bound_rejects(value):
+    with pytest.raises(ValueError):
+        parse_bound(value)
+
+START = 1704067200000
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLite(str(tmp_path / 'ClimateControlDB'))
+    rows = [(START + idx * 5000, 600.0 + idx, 21.0, 69.8, None if idx % 7 == 0 else 85.0) for idx in range(1234)]
+    db.insert_many(rows)
+    db.con.commit()
+    yield db, rows
+    db.close()
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 5000])
+def test_export_csv(db, chunk_size):
+    db, rows = db
+    text = ''.join(export(db.cur, 'csv', START / 1000 + 5, START / 1000 + 500, chunk_size))
+
+    lines = list(csv.reader(io.StringIO(text)))
+    assert lines[0] == ['ts', 'co2', 'tempC', 'tempF', 'humidity']
+    expected = [row for row in rows if START + 5000 <= row[0] < START + 500000]
+    assert [[int(line[0])] + [float(v) if v else None for v in line[1:]] for line in lines[1:]] == [list(row) for row in expected]
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 5000])
+def test_export_npz(db, chunk_size):
+    db, rows = db
+    data = b''.join(export(db.cur, 'npz', 0, None, chunk_size))
+
+    readings = np.load(io.BytesIO(data))['readings']
+    assert readings.dtype == EXPORT_DTYPE
+    assert readings['ts'].tolist() == [row[0] for row in rows]
+    assert readings['co2'].tolist() == [row[1] for row in rows]
+    assert [None if math.isnan(value) else value for value in readings['humidity'].tolist()] == [row[4] for row in rows]
+    assert not db.con.in_transaction
+
+def test_export_unknown_format(db):
+    db, rows = db
+    with pytest.raises(Exception, match='Unknown export format'):
+        export(db.cur, 'xlsx', 0)
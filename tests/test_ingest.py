@@ -0,0 +1,51 @@
+import time
+
+from threading import Event
+
+from lib.db import SQLite
+from lib.ingest import BatchWriter
+
+def rows(count):
+    now = int(time.time() * 1000)
+    return [(now - i * 1000, 600.0, 21.0, 69.8, 85.0) for i in range(count)]
+
+def test_close_writes_queued_rows(config):
+    writer = BatchWriter(config)
+    writer.start()
+    for row in rows(25):
+        writer.put(row)
+
+    writer.close()
+
+    assert not writer.is_alive()
+    assert (writer.rows_written, writer.rows_dropped) == (25, 0)
+    db = SQLite.from_config(config, readonly=True)
+    assert db.cur.execute('SELECT COUNT(*) FROM readings').fetchone()[0] == 25
+    db.close()
+
+def test_close_without_thread_drops_queue(config):
+    writer = BatchWriter(config)
+    for row in rows(config.database['queue_size'] + 5):
+        writer.put(row)
+
+    start = time.monotonic()
+    writer.close(timeout=5)
+
+    assert time.monotonic() - start < 1
+    assert writer.rows_dropped == 5 + config.database['queue_size']
+    assert writer.queue.empty()
+
+def test_close_gives_up_on_stuck_thread(config):
+    stuck = Event()
+    writer = BatchWriter(config)
+    writer.run = stuck.wait
+    writer.start()
+    for row in rows(config.database['queue_size']):
+        writer.put(row)
+
+    start = time.monotonic()
+    writer.close(timeout=0.1)
+
+    assert time.monotonic() - start < 1
+    assert writer.is_alive()
+    stuck.set()
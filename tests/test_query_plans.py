@@ -0,0 +1,24 @@
+import pytest
+
+from lib.analytics import ANALYTICS_QUERIES
+from lib.db import SQLite
+from lib.query import check_query_plans, query_plan, RANGE_QUERIES
+
+QUERIES = dict(RANGE_QUERIES, **ANALYTICS_QUERIES)
+
+@pytest.fixture(params=[False, True], ids=['rowid', 'without_rowid'])
+def db(request, tmp_path):
+    db = SQLite(str(tmp_path / 'ClimateControlDB'), without_rowid=request.param, journal_mode='WAL')
+    yield db
+    db.close()
+
+@pytest.mark.parametrize('name', sorted(QUERIES))
+def test_range_query_searches_index(db, name):
+    assert check_query_plans(db.cur, {name: QUERIES[name]})
+
+def test_full_scan_is_reported(db):
+    query = "SELECT ts FROM readings WHERE co2 > ?;"
+    assert any(detail.startswith('SCAN') for detail in query_plan(db.cur, query, (0,)))
+
+    with pytest.raises(Exception, match='full scan'):
+        check_query_plans(db.cur, {'unindexed': query.replace('?', '0')})
@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from lib.relay import RelayRegister
+
+class Bus(object):
+    def __init__(self):
+        self.values = []
+        self.failing = False
+
+    def write_byte_data(self, address, command, value):
+        if self.failing:
+            raise OSError(121, 'Remote I/O error')
+        self.values.append(value)
+
+@pytest.fixture
+def bus():
+    return Bus()
+
+@pytest.fixture
+def register(bus):
+    register = RelayRegister(bus, 0x11, 0x10)
+    register.flush()
+    return register
+
+def test_batch_writes_once(bus, register):
+    with register.batch():
+        register.set_channel(1, True)
+        with register.batch():
+            register.set_channel(3, True)
+        assert bus.values == [0]
+
+    assert bus.values == [0, 0b101]
+    assert register.shadow == 0b101
+
+def test_unchanged_value_skipped(bus, register):
+    with register.batch():
+        register.set_channel(2, True)
+        register.set_channel(2, False)
+
+    assert bus.values == [0]
+    assert register.skipped == 1
+
+def test_callbacks_run_after_write(bus, register):
+    seen = []
+    with register.batch():
+        register.set_channel(1, True, lambda: seen.append(list(bus.values)))
+        thread = threading.Thread(target=register.set_channel, args=(2, True, lambda: seen.append(list(bus.values))))
+        thread.start()
+        thread.join()
+        assert seen == []
+
+    assert seen == [[0, 0b11], [0, 0b11]]
+
+def test_failed_batch_write_stays_pending(bus, register):
+    seen = []
+    bus.failing = True
+    with register.batch():
+        register.set_channel(1, True, seen.append, 'on')
+
+    assert seen == []
+    assert register.shadow is None
+
+    # The next batch retries the write even without another change
+    bus.failing = False
+    with register.batch():
+        pass
+
+    assert bus.values == [0, 1]
+    assert seen == ['on']
+
+def test_failed_flush_stays_pending(bus, register):
+    bus.failing = True
+    with register.batch():
+        register.set_channel(2, True)
+    register.flush()
+
+    bus.failing = False
+    register.flush()
+    assert bus.values == [0, 0b10]
+
+def test_failed_write_outside_batch_raises(bus, register):
+    seen = []
+    bus.failing = True
+    with pytest.raises(OSError):
+        register.set_channel(4, True, seen.append, 'on')
+
+    bus.failing = False
+    register.set_channel(1, True)
+    assert bus.values == [0, 0b1001]
+    assert seen == ['on']
+
+def test_callback_error_does_not_stop_others(register):
+    seen = []
+    with register.batch():
+        register.set_channel(1, True, lambda: 1 / 0)
+        register.set_channel(2, True, seen.append, 'ran')
+
+    assert seen == ['ran']
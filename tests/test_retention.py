@@ -0,0 +1,58 @@
+import time
+
+from lib.db import SQLite
+from lib.ingest import BatchWriter
+from lib.retention import Compactor
+from lib.rollup import catch_up_rollups
+
+DAY = 24 * 3600 * 1000
+
+def fill(config, start, end, step=60000, rollup=True):
+    db = SQLite.from_config(config)
+    db.insert_many([(ts, 600.0, 21.0, 69.8, 85.0) for ts in range(start, end, step)])
+    db.con.commit()
+    if rollup:
+        catch_up_rollups(db.con)
+    db.close()
+
+def count(config, table, where='1'):
+    db = SQLite.from_config(config, readonly=True)
+    try:
+        return db.cur.execute("SELECT count(*) FROM {} WHERE {}".format(table, where)).fetchone()[0]
+    finally:
+        db.close()
+
+def test_writer_compacts_on_its_own_connection(config):
+    now = int(time.time() * 1000)
+    fill(config, now - 20 * DAY, now - 10 * DAY)
+    rolled_up = count(config, 'rollup_1m')
+    before = count(config, 'readings')
+
+    compactor = Compactor(config)
+    writer = BatchWriter(config, compactor)
+    writer.start()
+    for idx in range(25):
+        writer.put((now + idx * 5000, 600.0, 21.0, 69.8, 85.0))
+    writer.close()
+
+    cutoff = now - 14 * DAY
+    assert count(config, 'readings', 'ts < {}'.format(cutoff - 60000)) == 0
+    assert count(config, 'readings', 'ts >= {}'.format(now)) == 25
+    assert count(config, 'rollup_1m') >= rolled_up
+    assert compactor.rows_deleted == before + 25 - count(config, 'readings') > 0
+    assert writer.rows_written == 25 and writer.rows_dropped == 0
+
+def test_rows_are_kept_until_rolled_up(config):
+    now = int(time.time() * 1000)
+    fill(config, now - 20 * DAY, now - 18 * DAY)
+    fill(config, now - 18 * DAY, now - 16 * DAY, rollup=False)
+
+    db = SQLite.from_config(config)
+    try:
+        Compactor(config).compact(db)
+        rolled_up = db.cur.execute("SELECT max(ts) FROM rollup_1m").fetchone()[0]
+    finally:
+        db.close()
+
+    assert count(config, 'readings', 'ts < {}'.format(rolled_up)) == 0
+    assert count(config, 'readings', 'ts >= {}'.format(now - 18 * DAY)) == 2 * 24 * 60
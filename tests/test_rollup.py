@@ -0,0 +1,91 @@
+import random
+
+from collections import defaultdict
+
+import pytest
+
+import lib.rollup
+
+from lib.db import SQLite, READING_COLUMNS, ROLLUP_TIERS
+from lib.rollup import catch_up_rollups, select_tier, update_rollups
+
+HOUR = 3600 * 1000
+
+def make_readings(start, hours, seed=1):
+    rand = random.Random(seed)
+    rows = []
+    for ts in range(start, start + hours * HOUR, 5000):
+        # An hour long outage in the middle and occasional missing values
+        if start + 2 * HOUR <= ts < start + 3 * HOUR:
+            continue
+        rows.append([ts] + [None if rand.random() < 0.05 else rand.uniform(0, 1000) for _ in READING_COLUMNS[1:]])
+
+    return rows
+
+def expected_tier(rows, seconds):
+    buckets = defaultdict(list)
+    for row in rows:
+        buckets[row[0] // (seconds * 1000) * seconds * 1000].append(row)
+
+    expected = dict()
+    for bucket, bucket_rows in buckets.items():
+        values = []
+        for idx in range(1, len(READING_COLUMNS)):
+            column = [row[idx] for row in bucket_rows if row[idx] is not None]
+            values += [min(column, default=None), max(column, default=None), sum(column) if column else None, len(column)]
+        expected[bucket] = values
+
+    return expected
+
+def assert_tiers(db, rows):
+    for table, seconds in ROLLUP_TIERS:
+        stored = {row[0]: list(row[1:]) for row in db.cur.execute("SELECT * FROM {} ORDER BY ts".format(table))}
+        expected = expected_tier(rows, seconds)
+        assert stored.keys() == expected.keys(), table
+        for bucket, values in expected.items():
+            assert stored[bucket] == pytest.approx(values), (table, bucket)
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLite(str(tmp_path / 'ClimateControlDB'))
+    yield db
+    db.close()
+
+def test_catch_up_builds_every_tier(db, monkeypatch):
+    # Small chunks so buckets straddle chunk boundaries
+    monkeypatch.setattr(lib.rollup, 'CATCH_UP_CHUNK', HOUR // 2 + 7000)
+    rows = make_readings(1704067200000 + 123000, 6)
+    db.insert_many(rows)
+    db.con.commit()
+
+    catch_up_rollups(db.con)
+    assert_tiers(db, rows)
+
+def test_catch_up_resumes_after_downtime(db):
+    rows = make_readings(1704067200000, 6)
+    first, later = rows[:len(rows) // 3], rows[len(rows) // 3:]
+
+    db.insert_many(first)
+    db.con.commit()
+    catch_up_rollups(db.con)
+
+    db.insert_many(later)
+    db.con.commit()
+    catch_up_rollups(db.con)
+
+    assert_tiers(db, rows)
+
+def test_update_rollups_is_idempotent_for_partial_buckets(db):
+    rows = make_readings(1704067200000, 1)
+    for row in rows:
+        db.insert_many([row])
+        update_rollups(db.cur, row[0], row[0] + 1)
+    db.con.commit()
+
+    update_rollups(db.cur, rows[0][0])
+    assert_tiers(db, rows)
+
+def test_select_tier():
+    assert select_tier(3600) is None
+    assert select_tier(24 * 3600) == 'rollup_1m'
+    assert select_tier(30 * 24 * 3600) == 'rollup_1h'
@@ -0,0 +1,103 @@
+import pytest
+
+from lib.sampling import SampleScheduler
+
+def test_failures_back_off_to_the_period():
+    sampler = SampleScheduler(5, poll_interval=0.02)
+    sampler.wait()
+
+    delays = [sampler.failed() for _ in range(12)]
+
+    assert delays[:3] == pytest.approx([0.04, 0.08, 0.16])
+    assert delays == sorted(delays)
+    assert delays[-1] == 5
+    assert sampler.errors == 12
+
+@pytest.mark.parametrize('recover', ['not_ready', 'ready'])
+def test_successful_poll_resets_backoff(recover):
+    sampler = SampleScheduler(5, poll_interval=0.02)
+    sampler.wait()
+    for _ in range(6):
+        sampler.failed()
+
+    getattr(sampler, recover)()
+
+    assert sampler.failures == 0
+    assert sampler.failed() == pytest.approx(0.04)
+    assert sampler.errors == 7
+
+class FakeClock(object):
+    """Stands in for the time module, sleeping only advances the clock"""
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.now += max(delay, 0)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr('lib.sampling.time', clock)
+    return clock
+
+def test_failures_do_not_time_the_period(clock):
+    sampler = SampleScheduler(5)
+    sampler.wait()
+    sampler.ready()
+
+    sampler.wait()
+    sampler.not_ready()
+    sampler.failed()
+    sampler.ready()
+
+    assert sampler.period == 5
+
+def read_samples(sampler, clock, period, phase, count):
+    """Reads count samples from a sensor producing one every period seconds
+    after phase, the way read_wait_scd4x does, and returns the polls, the
+    seconds between each sample being ready and read, and samples missed"""
+    polls, latencies, missed = [], [], []
+    last = int((clock.now - phase) // period)
+    for _ in range(count):
+        start = sampler.polls
+        sampler.wait()
+        while (clock.now - phase) // period <= last:
+            clock.sleep(sampler.not_ready())
+
+        ready = int((clock.now - phase) // period)
+        polls.append(sampler.polls - start + 1)
+        latencies.append(clock.now - (phase + ready * period))
+        missed.append(ready - last - 1)
+        last = ready
+        sampler.ready()
+
+    return polls, latencies, missed
+
+@pytest.mark.parametrize('period', [5.0, 5.15, 4.9, 4.999])
+@pytest.mark.parametrize('phase', [0.0, 2.3])
+def test_period_and_phase_converge(clock, period, phase):
+    sampler = SampleScheduler(5)
+    assert sampler.wait_time() == 0.0
+
+    read_samples(sampler, clock, period, phase, 200)
+    polls, latencies, missed = read_samples(sampler, clock, period, phase, 100)
+
+    assert sampler.period == pytest.approx(period, rel=0.002)
+    # Polling starts just ahead of each sample and reads it within a poll
+    assert max(polls) <= 4 and sum(polls) / len(polls) <= 3.1
+    assert max(latencies) <= sampler.poll_interval + 1e-9
+    assert sum(missed) == 0
+
+def test_wait_time_until_polling(clock):
+    sampler = SampleScheduler(5)
+    read_samples(sampler, clock, 5.0, 0.0, 50)
+
+    # Polling starts the guard ahead of the next sample
+    assert sampler.wait_time() == pytest.approx(sampler.period - sampler.guard - (clock.now - sampler._last_ready))
+    assert sampler.min_guard <= sampler.guard < 5.0 / 4
+
+    clock.sleep(10)
+    assert sampler.wait_time() == 0.0
@@ -0,0 +1,121 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import streamserver
+
+@pytest.fixture
+def server(tmp_path):
+    server = streamserver.StreamServer('127.0.0.1:0', str(tmp_path), size=16, max_clients=60, keepalive=0.3)
+    server.start()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05, ))
+    thread.start()
+    yield server
+    server.stop()
+    thread.join()
+    server.close()
+
+def publish(server, payload):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.sendto(payload, server.path)
+    sock.close()
+
+def wait_for(server, seq, timeout=2):
+    give_up = time.monotonic() + timeout
+    while server.seq < seq and time.monotonic() < give_up:
+        time.sleep(0.01)
+
+    return server.seq
+
+def wait_for_clients(server, timeout=2):
+    give_up = time.monotonic() + timeout
+    while server.clients and time.monotonic() < give_up:
+        time.sleep(0.01)
+
+    return not server.clients
+
+def connect(server, path='/api/stream', headers=''):
+    sock = socket.create_connection(server.address, timeout=2)
+    sock.sendall('GET {} HTTP/1.1\r\nHost: localhost\r\n{}\r\n'.format(path, headers).encode('latin-1'))
+    return sock
+
+def read_until(sock, marker):
+    data = b''
+    while marker not in data:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+
+    return data
+
+def test_idle_clients_share_one_thread(server):
+    threads = threading.active_count()
+    clients = [connect(server) for _ in range(50)]
+    for sock in clients:
+        assert read_until(sock, b'retry: 5000\n\n').startswith(b'HTTP/1.1 200 OK\r\n')
+
+    assert threading.active_count() == threads
+    publish(server, b'{"type": "reading", "ts": 1}')
+    for sock in clients:
+        assert b'id: 1\nevent: reading\ndata: {"type": "reading", "ts": 1}\n\n' in read_until(sock, b'"ts": 1}\n\n')
+        sock.close()
+
+def test_streams_past_max_clients_refused(server):
+    server.max_clients = 2
+    clients = [connect(server) for _ in range(2)]
+    for sock in clients:
+        read_until(sock, b'retry: 5000\n\n')
+
+    refused = connect(server)
+    assert read_until(refused, b'\r\n\r\n').startswith(b'HTTP/1.1 503 ')
+    refused.close()
+
+    for sock in clients:
+        sock.close()
+
+def test_resume_after_last_event_id(server):
+    for ts in range(3):
+        publish(server, '{{"type": "reading", "ts": {}}}'.format(ts).encode('utf-8'))
+    wait_for(server, 3)
+
+    sock = connect(server, headers='Last-Event-ID: 1\r\n')
+    data = read_until(sock, b'"ts": 2}\n\n')
+    assert b'id: 1\n' not in data
+    assert b'id: 2\nevent: reading\n' in data and b'id: 3\nevent: reading\n' in data
+    sock.close()
+
+def test_malformed_events_dropped(server):
+    for payload in [b'not json', b'[1, 2]', b'"text"', b'{"no": "type"}', b'\xff\xfe']:
+        publish(server, payload)
+    publish(server, b'{"type": "relay", "channel": 1}')
+
+    assert wait_for(server, 1) == 1
+    assert list(server.events) == [(1, 'relay', '{"type": "relay", "channel": 1}')]
+
+def test_idle_stream_keepalive(server):
+    sock = connect(server)
+    assert b': keepalive\n\n' in read_until(sock, b': keepalive\n\n')
+    sock.close()
+
+@pytest.mark.parametrize('request_line, status', [
+    (b'GET /api/readings HTTP/1.1', b'404'),
+    (b'POST /api/stream HTTP/1.1', b'405'),
+    (b'nonsense', b'400'),
+    ])
+def test_other_requests_answered(server, request_line, status):
+    sock = socket.create_connection(server.address, timeout=2)
+    sock.sendall(request_line + b'\r\n\r\n')
+    response = read_until(sock, b'\0')
+
+    assert response.startswith(b'HTTP/1.1 ' + status)
+    assert wait_for_clients(server)
+
+def test_closed_clients_dropped(server):
+    sock = connect(server)
+    read_until(sock, b'retry: 5000\n\n')
+    sock.close()
+
+    assert wait_for_clients(server)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from lib.timers import TimerScheduler
+
+@pytest.fixture
+def timers():
+    timers = TimerScheduler()
+    timers.start()
+    yield timers
+    timers.close(run_pending=False)
+
+def test_timers_fire_in_deadline_order(timers):
+    fired = []
+    done = threading.Event()
+    timers.schedule(0.15, done.set)
+    timers.schedule(0.1, fired.append, 'late')
+    timers.schedule(0.05, fired.append, 'early')
+
+    assert done.wait(2)
+    assert fired == ['early', 'late']
+    assert timers.fired == 3
+
+def test_sooner_timer_wakes_thread(timers):
+    done = threading.Event()
+    timers.schedule(60, done.set)
+    start = time.monotonic()
+    timers.schedule(0.05, done.set)
+
+    assert done.wait(2)
+    assert time.monotonic() - start < 1
+
+def test_cancelled_timer_not_run(timers):
+    fired = []
+    done = threading.Event()
+    timer = timers.schedule(0.05, fired.append, 'cancelled')
+    timers.schedule(0.1, done.set)
+    timers.cancel(timer)
+
+    assert timers.pending() == 1
+    assert done.wait(2)
+    assert fired == []
+
+def test_callback_error_does_not_stop_thread(timers):
+    done = threading.Event()
+    timers.schedule(0.01, lambda: 1 / 0)
+    timers.schedule(0.05, done.set)
+
+    assert done.wait(2)
+    assert timers.is_alive()
+
+def test_close_runs_pending():
+    fired = []
+    timers = TimerScheduler()
+    timers.start()
+    timers.schedule(60, fired.append, 'second')
+    timers.schedule(30, fired.append, 'first')
+    cancelled = timers.schedule(10, fired.append, 'cancelled')
+    timers.cancel(cancelled)
+
+    timers.close(run_pending=True)
+
+    assert not timers.is_alive()
+    assert fired == ['first', 'second']
+
+def test_close_drops_pending():
+    fired = []
+    timers = TimerScheduler()
+    timers.start()
+    timers.schedule(60, fired.append, 'dropped')
+
+    timers.close(run_pending=False)
+
+    assert fired == []
+    with pytest.raises(Exception):
+        timers.schedule(1, fired.append, 'closed')
@@ -0,0 +1,176 @@
+import io
+import os
+import struct
+import threading
+
+import pytest
+
+import wfastcgi
+
+class ChunkedReader(io.RawIOBase):
+    """Delivers data at most chunk_size bytes per read, like a pipe"""
+    def __init__(self, data, chunk_size):
+        self.data = memoryview(data)
+        self.chunk_size = chunk_size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.chunk_size, len(self.data))
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+def record(reqtype, req_id, content, padding=0):
+    header = struct.pack('>BBHHBB', wfastcgi.FCGI_VERSION_1, reqtype, req_id, len(content), padding, 0)
+    return header + content + b'\0' * padding
+
+@pytest.fixture
+def processed(monkeypatch):
+    contents = []
+    monkeypatch.setitem(wfastcgi._REQUESTS, 1, wfastcgi.FastCgiRecord(wfastcgi.FCGI_BEGIN_REQUEST, 1, 1, 0))
+    monkeypatch.setitem(
+        wfastcgi.REQUEST_PROCESSORS, wfastcgi.FCGI_STDIN,
+        lambda stream, req_id, content: contents.append(content.tobytes())
+        )
+    return contents
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 5, 7, 64])
+@pytest.mark.parametrize('buffer_size', [24, 32, 4096])
+def test_record_split_across_reads(processed, chunk_size, buffer_size):
+    contents = [b'A' * 13, b'B' * 8, b'', b'C' * 17]
+    data = b''.join(record(wfastcgi.FCGI_STDIN, 1, content, padding=3) for content in contents)
+    stream = wfastcgi.FastCgiStream(ChunkedReader(data, chunk_size), buffer_size=buffer_size)
+
+    for _ in contents:
+        wfastcgi.read_fastcgi_record(stream)
+
+    assert processed == contents
+
+def test_end_of_stream_exits(processed):
+    stream = wfastcgi.FastCgiStream(ChunkedReader(b'', 4), buffer_size=32)
+
+    with pytest.raises(wfastcgi._ExitException):
+        wfastcgi.read_fastcgi_record(stream)
+
+class PipeStream(object):
+    """The write side of FastCgiStream over a pipe, drained by a thread"""
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.write_lock = threading.Lock()
+        self.chunks = []
+        self.reader = threading.Thread(target=self._drain)
+        self.reader.start()
+
+    def _drain(self):
+        while True:
+            data = os.read(self.read_fd, 65536)
+            if not data:
+                break
+            self.chunks.append(data)
+        os.close(self.read_fd)
+
+    def fileno(self):
+        return self.write_fd
+
+    def flush(self):
+        pass
+
+    def close(self):
+        os.close(self.write_fd)
+        self.reader.join()
+        return b''.join(self.chunks)
+
+def parse_records(data):
+    records = []
+    while data:
+        fcgi_ver, reqtype, req_id, content_size, padding_len, _ = struct.unpack('>BBHHBB', data[:8])
+        assert fcgi_ver == wfastcgi.FCGI_VERSION_1
+        records.append((reqtype, req_id, data[8:8 + content_size]))
+        data = data[8 + content_size + padding_len:]
+
+    return records
+
+@pytest.fixture
+def pipe_stream():
+    return PipeStream()
+
+@pytest.mark.parametrize('size', [0, 1, 0xFFFF, 0x10000, 200000, 0xFFFF * wfastcgi.WRITEV_RECORDS + 5])
+def test_streaming_response_framing(pipe_stream, size):
+    content = bytes(bytearray(i % 251 for i in range(size)))
+    wfastcgi.send_response(pipe_stream, 3, wfastcgi.FCGI_STDOUT, content)
+    records = parse_records(pipe_stream.close())
+
+    # Full records, then the remainder, then the empty record ending the stream
+    assert [len(record[2]) for record in records] == [0xFFFF] * (size // 0xFFFF) + ([size % 0xFFFF] if size % 0xFFFF else []) + [0]
+    assert all(record[:2] == (wfastcgi.FCGI_STDOUT, 3) for record in records)
+    assert b''.join(record[2] for record in records) == content
+
+def test_single_record_response(pipe_stream):
+    wfastcgi.send_response(pipe_stream, 7, wfastcgi.FCGI_END_REQUEST, b'\0' * 8, streaming=False)
+
+    assert parse_records(pipe_stream.close()) == [(wfastcgi.FCGI_END_REQUEST, 7, b'\0' * 8)]
+
+def test_partial_writes_resume(pipe_stream, monkeypatch):
+    writev = os.writev
+    monkeypatch.setattr(os, 'writev', lambda fd, buffers: writev(fd, [memoryview(b''.join(buffers))[:7]]))
+
+    content = b'x' * 100000
+    wfastcgi.send_response(pipe_stream, 1, wfastcgi.FCGI_STDOUT, content)
+
+    assert b''.join(record[2] for record in parse_records(pipe_stream.close())) == content
+
+def test_without_writev(pipe_stream, monkeypatch):
+    monkeypatch.delattr(os, 'writev')
+
+    content = b'y' * 100000
+    wfastcgi.send_response(pipe_stream, 1, wfastcgi.FCGI_STDOUT, content)
+
+    assert b''.join(record[2] for record in parse_records(pipe_stream.close())) == content
+
+@pytest.fixture
+def restart_pending(monkeypatch):
+    monkeypatch.setattr(wfastcgi, '_RESTART_PENDING', threading.Event())
+    monkeypatch.setattr(wfastcgi, '_REQUESTS', {})
+    return wfastcgi._RESTART_PENDING
+
+def test_new_requests_refused_while_restarting(pipe_stream, restart_pending):
+    restart_pending.set()
+    data = record(wfastcgi.FCGI_BEGIN_REQUEST, 5, b'\0\1\0\0\0\0\0\0') + record(wfastcgi.FCGI_PARAMS, 5, b'') + record(wfastcgi.FCGI_STDIN, 5, b'')
+    stream = wfastcgi.FastCgiStream(ChunkedReader(data, 64), buffer_size=64)
+    stream.fileno = pipe_stream.fileno
+    stream.flush = pipe_stream.flush
+    stream.write_lock = pipe_stream.write_lock
+
+    assert [wfastcgi.read_fastcgi_record(stream) for _ in range(3)] == [None] * 3
+    assert wfastcgi._REQUESTS == {}
+    assert parse_records(pipe_stream.close()) == [
+        (wfastcgi.FCGI_END_REQUEST, 5, struct.pack('>IB3x', 0, wfastcgi.FCGI_OVERLOADED))
+        ]
+
+def test_recycle_ends_open_requests(pipe_stream, restart_pending, monkeypatch):
+    exits = []
+    monkeypatch.setattr(wfastcgi, 'RESTART_TIMEOUT', 0.2)
+    monkeypatch.setattr(wfastcgi.os, '_exit', exits.append)
+    wfastcgi._REQUESTS[9] = wfastcgi.FastCgiRecord(wfastcgi.FCGI_BEGIN_REQUEST, 9, 1, 0)
+
+    wfastcgi.recycle(pipe_stream)
+
+    assert restart_pending.is_set()
+    assert exits == [0]
+    assert parse_records(pipe_stream.close()) == [
+        (wfastcgi.FCGI_END_REQUEST, 9, struct.pack('>IB3x', 1, wfastcgi.FCGI_REQUEST_COMPLETE))
+        ]
+
+def test_recycle_waits_for_requests_in_flight(pipe_stream, restart_pending, monkeypatch):
+    exits = []
+    monkeypatch.setattr(wfastcgi.os, '_exit', exits.append)
+    wfastcgi._REQUESTS[2] = wfastcgi.FastCgiRecord(wfastcgi.FCGI_BEGIN_REQUEST, 2, 1, 0)
+    finish = threading.Timer(0.2, wfastcgi._REQUESTS.pop, (2, ))
+    finish.start()
+
+    wfastcgi.recycle(pipe_stream)
+
+    assert exits == [0]
+    assert parse_records(pipe_stream.close()) == []